@@ -1,98 +1,820 @@
 """ Algorithms implementation in Python"""
 
+import array as pyarray
+import heapq
+import inspect
+import itertools
+import math
+import operator
+import random
+import weakref
 
-import graphics
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-def get_start_element(array, start, _end):
+INSERTION_SORT_CUTOFF = 16
+NINTHER_CUTOFF = 128
+SIEVE_SEGMENT = 1 << 18
+SMALL_PRIMES_LIMIT = 1000
+# deterministic Miller-Rabin bases for numbers below 2**64
+MILLER_RABIN_BASES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+# deterministic Miller-Rabin bases below MILLER_RABIN_LIMIT
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+MILLER_RABIN_LIMIT = 3317044064679887385961981
+# is_prime_many() sieves if range plus sqrt of its end is at most this many
+# times longer than batch
+BATCH_SIEVE_DENSITY = 16
+BATCH_SIEVE_LIMIT = 10**14
+# integer_sort() uses counting sort for key ranges up to this many times
+# longer than array, radix sort otherwise
+COUNTING_SORT_DENSITY = 4
+RADIX_BITS = 8
+NUMPY_SORT_CUTOFF = 1024
+NUMERIC_TYPECODES = 'bBhHiIlLqQfd'
+# typecode of integers with the same bits and mask turning them into keys
+FLOAT_BITS = {'f': ('i', 0x7FFFFFFF), 'd': ('q', 0x7FFFFFFFFFFFFFFF)}
+# runs shorter than that are extended by binary insertion
+MIN_MERGE = 32
+MIN_GALLOP = 7
+
+
+def get_start_element(array, start, _end, _compare=None):
     """ Select start element of array"""
     return array[start]
 
 
-def get_last_element(array, _start, end):
+def get_last_element(array, _start, end, _compare=None):
     """ Select last element of array"""
     return array[end - 1]
 
 
-def get_middle_element(array, start, end):
+def get_middle_element(array, start, end, _compare=None):
     """ Select middle element of array"""
     return array[(start + end)//2]
 
 
-def quick_sort(array, compare=lambda x, y: x < y, pivot_fn=get_start_element,
-               start=0, end=None):
+def median_of_three(first, second, third, compare=lambda x, y: x < y):
+    """ Median of three values"""
+    if compare(second, first):
+        first, second = second, first
+    if compare(third, second):
+        second = third
+        if compare(second, first):
+            second = first
+    return second
+
+
+def get_median_of_three(array, start, end, compare=lambda x, y: x < y):
+    """ Select median of start, middle and last elements of array"""
+    return median_of_three(array[start], array[(start + end)//2],
+                           array[end - 1], compare)
+
+
+def get_ninther(array, start, end, compare=lambda x, y: x < y):
+    """ Select Tukey's ninther: median of three medians of three"""
+    if end - start < NINTHER_CUTOFF:
+        return get_median_of_three(array, start, end, compare)
+    step = (end - start)//8
+    middle = (start + end)//2
+    return median_of_three(
+        median_of_three(array[start], array[start + step],
+                        array[start + 2*step], compare),
+        median_of_three(array[middle - step], array[middle],
+                        array[middle + step], compare),
+        median_of_three(array[end - 1 - 2*step], array[end - 1 - step],
+                        array[end - 1], compare),
+        compare)
+
+
+def partition(array, compare, pivot, start, end):
+    """ Three-way partition around pivot, returns range equal to it"""
+    left = start
+    right = end - 1
+    while True:
+        while compare(array[left], pivot):
+            left += 1
+        while compare(pivot, array[right]):
+            right -= 1
+        if compare(array[right], array[left]):
+            array[left], array[right] = array[right], array[left]
+        else:
+            break
+    i = left + 1
+    while i <= right:
+        if compare(array[i], pivot):
+            array[left], array[i] = array[i], array[left]
+            left += 1
+        elif compare(pivot, array[i]):
+            array[right], array[i] = array[i], array[right]
+            right -= 1
+            while compare(pivot, array[right]):
+                right -= 1
+        else:
+            i += 1
+    return left, right + 1
+
+
+def is_numeric_array(array):
+    """ Whether array is array.array of machine numbers"""
+    return isinstance(array, pyarray.array) and \
+        array.typecode in NUMERIC_TYPECODES
+
+
+def float_keys(values, bits_typecode, mask):
+    """ Integers ordered as floats of the same bits, and back"""
+#    flip all but sign bit of negative ones to reverse their order
+    return pyarray.array(bits_typecode, [value ^ mask if value < 0 else value
+                                         for value in values])
+
+
+def typed_sort(array, start, end, reverse):
+    """ Sort range of numeric array.array w/o comparisons"""
+    values = array[start:end]
+    if array.typecode in FLOAT_BITS:
+        bits_typecode, mask = FLOAT_BITS[array.typecode]
+        bits = pyarray.array(bits_typecode)
+        bits.frombytes(values.tobytes())
+        keys = float_keys(bits, bits_typecode, mask)
+        integer_sort(keys, reverse=reverse)
+        values = pyarray.array(array.typecode)
+        values.frombytes(float_keys(keys, bits_typecode, mask).tobytes())
+    else:
+        integer_sort(values, reverse=reverse)
+    array[start:end] = values
+
+
+def keyed_sort(sort, array, compare, key, reverse, start=0, end=None):
+    """ Run sort(array, compare, start, end) with key and reverse"""
+    if end is None:
+        end = len(array)
+    if key is None and compare is operator.lt and is_numeric_array(array):
+        typed_sort(array, start, end, reverse)
+        return
+    order = compare
+    if reverse:
+        order = operator.gt if compare is operator.lt else \
+            lambda x, y: compare(y, x)
+    if key is None:
+        sort(array, order, start, end)
+        return
+#    decorate with keys computed once, indices keep stable sorts stable
+    values = array[start:end]
+    if compare is operator.lt:
+        sign = -1 if reverse else 1
+        decorated = [(key(value), sign*index)
+                     for index, value in enumerate(values)]
+        sort(decorated, order, 0, len(decorated))
+    else:
+        decorated = [(key(value), index)
+                     for index, value in enumerate(values)]
+        sort(decorated, lambda x, y: order(x[0], y[0]), 0, len(decorated))
+    result = [values[abs(index)] for _, index in decorated]
+    if isinstance(array, pyarray.array):
+        result = pyarray.array(array.typecode, result)
+    array[start:end] = result
+
+
+# pivot function: whether takes_compare() found it taking compare
+PIVOT_TAKES_COMPARE = weakref.WeakKeyDictionary()
+
+
+def takes_compare(pivot_fn):
+    """ Whether fourth positional parameter of pivot_fn is named compare"""
+#    by name only: a defaulted fourth parameter such as depth=0 is not
+#    given compare; results are remembered while pivot_fn is alive
+    try:
+        return PIVOT_TAKES_COMPARE[pivot_fn]
+    except (KeyError, TypeError):
+        pass
+    try:
+        parameters = [parameter for parameter in
+                      inspect.signature(pivot_fn).parameters.values()
+                      if parameter.kind in (parameter.POSITIONAL_ONLY,
+                                            parameter.POSITIONAL_OR_KEYWORD)]
+    except (TypeError, ValueError):
+        parameters = []
+    result = len(parameters) > 3 and \
+        parameters[3].name.lstrip('_') == 'compare'
+    try:
+        PIVOT_TAKES_COMPARE[pivot_fn] = result
+    except TypeError:
+        pass
+    return result
+
+
+def select_pivot(pivot_fn, array, start, end, compare):
+    """ Pivot chosen by pivot_fn, given compare if it takes one"""
+    if takes_compare(pivot_fn):
+        return pivot_fn(array, start, end, compare)
+    return pivot_fn(array, start, end)
+
+
+def quick_sort(array, compare=operator.lt, pivot_fn=get_start_element,
+               start=0, end=None, introsort=False, key=None, reverse=False):
     """Quick Sort algorithm implementation"""
     if end is None:
         end = len(array)
     assert start <= end
-    if end - start > 1:
-        def equal(lhs, rhs):
-            return not (compare(lhs, rhs) or compare(lhs, rhs))
-        pivot = pivot_fn(array, start, end)
-#        trichotomy
-        left = start
-        right = end - 1
-        while True:
-            while compare(array[left], pivot):
-                left += 1
-            while compare(pivot, array[right]):
-                right -= 1
-            assert not compare(array[left], pivot)
-            assert not compare(pivot, array[right])
-            if compare(array[right], array[left]):
-                array[left], array[right] = array[right], array[left]
-            else:
+    if key is not None or reverse or \
+            compare is operator.lt and is_numeric_array(array):
+        keyed_sort(lambda values, order, low, high: quick_sort(
+            values, order, pivot_fn, low, high, introsort), array, compare,
+                   key, reverse, start, end)
+    elif introsort:
+        intro_sort(array, compare, pivot_fn, start, end)
+    elif end - start > 1:
+        left, right = partition(array, compare,
+                                select_pivot(pivot_fn, array, start, end,
+                                             compare),
+                                start, end)
+        quick_sort(array, compare, pivot_fn, start, left)
+        quick_sort(array, compare, pivot_fn, right, end)
+
+
+def intro_sort(array, compare=lambda x, y: x < y, pivot_fn=get_ninther,
+               start=0, end=None):
+    """Introsort"""
+    if end is None:
+        end = len(array)
+    assert start <= end
+    ranges = [(start, end, 2*(end - start).bit_length())]
+    while ranges:
+        start, end, depth = ranges.pop()
+        while end - start > INSERTION_SORT_CUTOFF:
+            if depth == 0:
+                heap_sort(array, compare, start, end)
                 break
-        assert equal(array[left], pivot)
-        assert equal(array[right], pivot)
-        i = left + 1
-        while i <= right:
-            assert equal(array[left], pivot)
-            assert not compare(pivot, array[right])
-            if compare(array[i], pivot):
-                array[left], array[i] = array[i], array[left]
-                left += 1
-            elif compare(pivot, array[i]):
-                array[right], array[i] = array[i], array[right]
-                right -= 1
-                while compare(pivot, array[right]):
-                    right -= 1
+            depth -= 1
+            left, right = partition(array, compare,
+                                    select_pivot(pivot_fn, array, start, end,
+                                                 compare),
+                                    start, end)
+#            postpone larger side, go on with smaller one
+            if left - start < end - right:
+                ranges.append((right, end, depth))
+                end = left
             else:
-                i += 1
-        assert equal(array[left], pivot)
-        assert equal(array[right], pivot)
-        assert left < right + 1
-        quick_sort(array, compare, pivot_fn, start, left)
-        quick_sort(array, compare, pivot_fn, right + 1, end)
+                ranges.append((start, left, depth))
+                start = right
+        else:
+            insertion_sort(array, compare, start, end)
+
+
+def sift_down(array, compare, start, root, end, arity=2):
+    """ Restore heap property of array[start:end] below root"""
+#    heap keeps the greatest by compare at start
+    item = array[root]
+    while True:
+        child = arity*(root - start) + start + 1
+        if child >= end:
+            break
+        if arity == 2:
+            if child + 1 < end and compare(array[child], array[child + 1]):
+                child += 1
+        else:
+            for other in range(child + 1, min(child + arity, end)):
+                if compare(array[child], array[other]):
+                    child = other
+        if not compare(item, array[child]):
+            break
+        array[root] = array[child]
+        root = child
+    array[root] = item
+
+
+def sift_up(array, compare, start, position, arity=2):
+    """ Restore heap property of array[start:] above position"""
+    item = array[position]
+    while position > start:
+        parent = start + (position - start - 1)//arity
+        if not compare(array[parent], item):
+            break
+        array[position] = array[parent]
+        position = parent
+    array[position] = item
+
+
+def heapify(array, compare, start=0, end=None, arity=2):
+    """ Make array[start:end] a heap in O(n)"""
+    if end is None:
+        end = len(array)
+    for root in range(start + (end - start - 2)//arity, start - 1, -1):
+        sift_down(array, compare, start, root, end, arity)
 
 
-def insertion_sort(array, compare=lambda x, y: x < y):
+def heap_sort(array, compare=lambda x, y: x < y, start=0, end=None,
+              arity=2):
+    """Heap sort"""
+    if end is None:
+        end = len(array)
+    heapify(array, compare, start, end, arity)
+    for last in range(end - 1, start, -1):
+        array[start], array[last] = array[last], array[start]
+        sift_down(array, compare, start, start, last, arity)
+
+
+class Heap:
+    """ Priority queue popping values in compare order"""
+    __slots__ = ('items', 'order', 'arity', 'native')
+
+    def __init__(self, values=(), compare=operator.lt, arity=2,
+                 typecode=None):
+#        typecode keeps numbers unboxed in array.array
+        if typecode is None:
+            self.items = list(values)
+        else:
+            self.items = pyarray.array(typecode, values)
+#        heap functions keep the greatest by order at the root
+        self.order = operator.gt if compare is operator.lt else \
+            lambda x, y: compare(y, x)
+        self.arity = arity
+#        heapq functions keep the same layout of binary heaps in lists
+        self.native = compare is operator.lt and arity == 2 and \
+            typecode is None
+        self.heapify()
+
+    def __len__(self):
+        return len(self.items)
+
+    def heapify(self):
+        """ Restore heap after items were changed directly"""
+        if self.native:
+            heapq.heapify(self.items)
+        else:
+            heapify(self.items, self.order, 0, len(self.items), self.arity)
+
+    def peek(self):
+        """ First value in compare order"""
+        return self.items[0]
+
+    def push(self, value):
+        """ Add value"""
+        if self.native:
+            heapq.heappush(self.items, value)
+            return
+        self.items.append(value)
+        sift_up(self.items, self.order, 0, len(self.items) - 1, self.arity)
+
+    def pop(self):
+        """ Remove and return first value"""
+        if self.native:
+            return heapq.heappop(self.items)
+        last = self.items.pop()
+        if not self.items:
+            return last
+        first = self.items[0]
+        self.items[0] = last
+        sift_down(self.items, self.order, 0, 0, len(self.items), self.arity)
+        return first
+
+    def pushpop(self, value):
+        """ Push value, then pop first value"""
+        if self.native:
+            return heapq.heappushpop(self.items, value)
+        if not self.items or not self.order(value, self.items[0]):
+            return value
+        first = self.items[0]
+        self.items[0] = value
+        sift_down(self.items, self.order, 0, 0, len(self.items), self.arity)
+        return first
+
+    def replace(self, value):
+        """ Pop first value, then push value"""
+        if self.native:
+            return heapq.heapreplace(self.items, value)
+        first = self.items[0]
+        self.items[0] = value
+        sift_down(self.items, self.order, 0, 0, len(self.items), self.arity)
+        return first
+
+
+class IndexedHeap:
+    """ Priority queue of distinct items by their keys, keys can decrease"""
+    __slots__ = ('keys', 'items', 'positions', 'compare', 'arity')
+
+    def __init__(self, compare=operator.lt, arity=2, typecode=None):
+        self.keys = [] if typecode is None else pyarray.array(typecode)
+        self.items = []
+#        item: its index in keys and items
+        self.positions = {}
+        self.compare = compare
+        self.arity = arity
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def key(self, item):
+        """ Current key of item"""
+        return self.keys[self.positions[item]]
+
+    def move(self, item, key, position):
+        """ Put item and its key at position"""
+        self.keys[position] = key
+        self.items[position] = item
+        self.positions[item] = position
+
+    def sift_up(self, position):
+        """ Move item at position towards root while its key is less"""
+        key, item = self.keys[position], self.items[position]
+        while position > 0:
+            parent = (position - 1)//self.arity
+            if not self.compare(key, self.keys[parent]):
+                break
+            self.move(self.items[parent], self.keys[parent], position)
+            position = parent
+        self.move(item, key, position)
+
+    def sift_down(self, position):
+        """ Move item at position towards leaves while its key is greater"""
+        key, item = self.keys[position], self.items[position]
+        size = len(self.items)
+        while True:
+            child = self.arity*position + 1
+            if child >= size:
+                break
+            for other in range(child + 1, min(child + self.arity, size)):
+                if self.compare(self.keys[other], self.keys[child]):
+                    child = other
+            if not self.compare(self.keys[child], key):
+                break
+            self.move(self.items[child], self.keys[child], position)
+            position = child
+        self.move(item, key, position)
+
+    def push(self, item, key):
+        """ Add item with key"""
+        if item in self.positions:
+            raise KeyError("{!r} is already in heap".format(item))
+        self.keys.append(key)
+        self.items.append(item)
+        self.positions[item] = len(self.items) - 1
+        self.sift_up(len(self.items) - 1)
+
+    def peek(self):
+        """ First item in key order and its key"""
+        return self.items[0], self.keys[0]
+
+    def pop(self):
+        """ Remove first item, return it and its key"""
+        item, key = self.items[0], self.keys[0]
+        last_item, last_key = self.items.pop(), self.keys.pop()
+        del self.positions[item]
+        if self.items:
+            self.move(last_item, last_key, 0)
+            self.sift_down(0)
+        return item, key
+
+    def decrease_key(self, item, key):
+        """ Move item forward giving it a key not greater than current one"""
+        position = self.positions[item]
+        if self.compare(self.keys[position], key):
+            raise ValueError("new key {!r} is greater than {!r}".format(
+                key, self.keys[position]))
+        self.keys[position] = key
+        self.sift_up(position)
+
+
+def insertion_sort(array, compare=operator.lt, start=0, end=None, key=None,
+                   reverse=False):
     """Insertion sort"""
-    for top in range(1, len(array)):
+    if end is None:
+        end = len(array)
+    if key is not None or reverse or \
+            compare is operator.lt and is_numeric_array(array):
+        keyed_sort(insertion_sort, array, compare, key, reverse, start, end)
+        return
+    for top in range(start + 1, end):
         k = top
-        while k > 0 and compare(array[k], array[k - 1]):
+        while k > start and compare(array[k], array[k - 1]):
             array[k], array[k - 1] = array[k - 1], array[k]
             k -= 1
 
 
-def choice_sort(array, compare=lambda x, y: x < y):
+def nth_element(array, nth, compare=lambda x, y: x < y,
+                pivot_fn=get_ninther, start=0, end=None):
+    """ Put element of rank nth in place, lesser before, greater after it"""
+    if end is None:
+        end = len(array)
+    assert start <= nth < end
+    depth = 2*(end - start).bit_length()
+    while end - start > INSERTION_SORT_CUTOFF:
+        if depth == 0:
+            heap_sort(array, compare, start, end)
+            return
+        depth -= 1
+        left, right = partition(array, compare,
+                                select_pivot(pivot_fn, array, start, end,
+                                             compare),
+                                start, end)
+#        go on with the side holding nth only
+        if nth < left:
+            end = left
+        elif nth >= right:
+            start = right
+        else:
+            return
+    insertion_sort(array, compare, start, end)
+
+
+def quickselect(values, nth, compare=lambda x, y: x < y,
+                pivot_fn=get_ninther):
+    """ Element of rank nth, values are left intact"""
+    array = list(values)
+    nth_element(array, nth, compare, pivot_fn)
+    return array[nth]
+
+
+def partial_sort(array, middle, compare=lambda x, y: x < y,
+                 pivot_fn=get_ninther, start=0, end=None):
+    """ Put least middle - start elements sorted into array[start:middle]"""
+    if end is None:
+        end = len(array)
+    assert start <= middle <= end
+    if middle > start:
+        nth_element(array, middle - 1, compare, pivot_fn, start, end)
+        intro_sort(array, compare, pivot_fn, start, middle - 1)
+
+
+def top_k(values, k, compare=lambda x, y: x < y, pivot_fn=get_ninther):
+    """ Sorted list of k least values"""
+    array = list(values)
+    k = min(k, len(array))
+    partial_sort(array, k, compare, pivot_fn)
+    return array[:k]
+
+
+def top_k_stream(values, k, compare=lambda x, y: x < y):
+    """ Sorted list of k least values of iterable, in O(k) memory"""
+    if k <= 0:
+        return []
+    values = iter(values)
+    heap = list(itertools.islice(values, k))
+    heapify(heap, compare)
+#    heap root is the greatest of the least values seen so far
+    for value in values:
+        if compare(value, heap[0]):
+            heap[0] = value
+            sift_down(heap, compare, 0, 0, k)
+    heap_sort(heap, compare)
+    return heap
+
+
+def gallop(array, start, end, before, from_end=False):
+    """ First index of array[start:end] where before(value) turns false"""
+#    probe at doubling distances from start or end, then search binary
+    low, high = start, end
+    step = 1
+    if from_end:
+        probe = end - 1
+        while probe >= start and not before(array[probe]):
+            high = probe
+            probe -= step
+            step *= 2
+        low = max(probe + 1, start)
+    else:
+        probe = start
+        while probe < end and before(array[probe]):
+            low = probe + 1
+            probe += step
+            step *= 2
+        high = min(probe, end)
+    while low < high:
+        middle = (low + high)//2
+        if before(array[middle]):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def gallop_left(array, key, compare, start, end, from_end=False):
+    """ First index of array[start:end] with value not less than key"""
+    return gallop(array, start, end, lambda value: compare(value, key),
+                  from_end)
+
+
+def gallop_right(array, key, compare, start, end, from_end=False):
+    """ First index of array[start:end] with value greater than key"""
+    return gallop(array, start, end, lambda value: not compare(key, value),
+                  from_end)
+
+
+def count_run(array, compare, start, end):
+    """ End of run starting at start, strictly descending run is reversed"""
+    run = start + 1
+    if run >= end:
+        return end
+    if compare(array[run], array[start]):
+        run += 1
+        while run < end and compare(array[run], array[run - 1]):
+            run += 1
+        array[start:run] = array[start:run][::-1]
+    else:
+        run += 1
+        while run < end and not compare(array[run], array[run - 1]):
+            run += 1
+    return run
+
+
+def binary_insertion_sort(array, compare, start, sorted_end, end):
+    """ Stable insertion of array[sorted_end:end] into sorted prefix"""
+    for top in range(sorted_end, end):
+        item = array[top]
+        position = gallop_right(array, item, compare, start, top, True)
+        array[position + 1:top + 1] = array[position:top]
+        array[position] = item
+
+
+def min_run_length(size):
+    """ Run length making number of runs a power of two or slightly less"""
+    odd = 0
+    while size >= MIN_MERGE:
+        odd |= size & 1
+        size >>= 1
+    return size + odd
+
+
+def merge_lo(array, compare, start, middle, end, min_gallop):
+    """ Merge runs buffering the shorter left one, returns min_gallop"""
+    temp = array[start:middle]
+    size = len(temp)
+    i, j, k = 0, middle, start
+    while i < size and j < end:
+        wins_left = wins_right = 0
+        while i < size and j < end and max(wins_left, wins_right) < min_gallop:
+            if compare(array[j], temp[i]):
+                array[k] = array[j]
+                j += 1
+                wins_right += 1
+                wins_left = 0
+            else:
+                array[k] = temp[i]
+                i += 1
+                wins_left += 1
+                wins_right = 0
+            k += 1
+#        one run keeps winning, copy its elements in blocks
+        while i < size and j < end:
+            stop = gallop_right(temp, array[j], compare, i, size)
+            copied_left = stop - i
+            array[k:k + copied_left] = temp[i:stop]
+            k += copied_left
+            i = stop
+            if i == size:
+                break
+            stop = gallop_left(array, temp[i], compare, j, end)
+            copied_right = stop - j
+            array[k:k + copied_right] = array[j:stop]
+            k += copied_right
+            j = stop
+            if copied_left < MIN_GALLOP and copied_right < MIN_GALLOP:
+                min_gallop += 1
+                break
+            min_gallop = max(1, min_gallop - 1)
+    array[k:k + size - i] = temp[i:]
+    return min_gallop
+
+
+def merge_hi(array, compare, start, middle, end, min_gallop):
+    """ Merge runs buffering the shorter right one, returns min_gallop"""
+    temp = array[middle:end]
+    i, j, k = middle, len(temp), end
+    while i > start and j > 0:
+        wins_left = wins_right = 0
+        while i > start and j > 0 and \
+                max(wins_left, wins_right) < min_gallop:
+            k -= 1
+            if compare(temp[j - 1], array[i - 1]):
+                array[k] = array[i - 1]
+                i -= 1
+                wins_left += 1
+                wins_right = 0
+            else:
+                array[k] = temp[j - 1]
+                j -= 1
+                wins_right += 1
+                wins_left = 0
+        while i > start and j > 0:
+            stop = gallop_right(array, temp[j - 1], compare, start, i, True)
+            copied_left = i - stop
+            array[k - copied_left:k] = array[stop:i]
+            k -= copied_left
+            i = stop
+            if i == start:
+                break
+            stop = gallop_left(temp, array[i - 1], compare, 0, j, True)
+            copied_right = j - stop
+            array[k - copied_right:k] = temp[stop:j]
+            k -= copied_right
+            j = stop
+            if copied_left < MIN_GALLOP and copied_right < MIN_GALLOP:
+                min_gallop += 1
+                break
+            min_gallop = max(1, min_gallop - 1)
+    array[k - j:k] = temp[:j]
+    return min_gallop
+
+
+def merge_at(array, compare, runs, index, min_gallop):
+    """ Merge runs[index] with the next run, returns min_gallop"""
+    start, middle = runs[index]
+    end = runs[index + 1][1]
+    runs[index:index + 2] = [(start, end)]
+#    skip elements already in place at both ends
+    start = gallop_right(array, array[middle], compare, start, middle)
+    if start == middle:
+        return min_gallop
+    end = gallop_left(array, array[middle - 1], compare, middle, end, True)
+    if middle - start <= end - middle:
+        return merge_lo(array, compare, start, middle, end, min_gallop)
+    return merge_hi(array, compare, start, middle, end, min_gallop)
+
+
+def merge_collapse(array, compare, runs, min_gallop):
+    """ Merge runs on stack until their lengths decrease fast enough"""
+    def length(index):
+        return runs[index][1] - runs[index][0]
+    while len(runs) > 1:
+        index = len(runs) - 2
+        if index > 0 and length(index - 1) <= length(index) + \
+                length(index + 1) or index > 1 and length(index - 2) <= \
+                length(index - 1) + length(index):
+            if length(index - 1) < length(index + 1):
+                index -= 1
+        elif length(index) > length(index + 1):
+            break
+        min_gallop = merge_at(array, compare, runs, index, min_gallop)
+    return min_gallop
+
+
+def merge_sort(array, compare=lambda x, y: x < y, start=0, end=None):
+    """Stable natural merge sort, O(n) on presorted arrays"""
+    if end is None:
+        end = len(array)
+    assert start <= end
+    min_run = min_run_length(end - start)
+    min_gallop = MIN_GALLOP
+    runs = []
+    low = start
+    while low < end:
+        run_end = count_run(array, compare, low, end)
+        if run_end - low < min_run:
+            forced_end = min(low + min_run, end)
+            binary_insertion_sort(array, compare, low, run_end, forced_end)
+            run_end = forced_end
+        runs.append((low, run_end))
+        min_gallop = merge_collapse(array, compare, runs, min_gallop)
+        low = run_end
+    while len(runs) > 1:
+        min_gallop = merge_at(array, compare, runs, len(runs) - 2,
+                              min_gallop)
+
+
+def choice_sort(array, compare=operator.lt, key=None, reverse=False):
     """Choice sort"""
+    if key is not None or reverse or \
+            compare is operator.lt and is_numeric_array(array):
+        keyed_sort(lambda values, order, _start, _end: choice_sort(
+            values, order), array, compare, key, reverse)
+        return
     for pos in range(0, len(array) - 1):
         for k in range(pos + 1, len(array)):
             if compare(array[k], array[pos]):
                 array[k], array[pos] = array[pos], array[k]
 
 
-def bubble_sort(array, compare=lambda x, y: x < y):
+def bubble_sort(array, compare=operator.lt, key=None, reverse=False):
     """Bubble sort"""
+    if key is not None or reverse or \
+            compare is operator.lt and is_numeric_array(array):
+        keyed_sort(lambda values, order, _start, _end: bubble_sort(
+            values, order), array, compare, key, reverse)
+        return
     for bypass in range(1, len(array)):
         for k in range(0, len(array) - bypass):
             if compare(array[k + 1], array[k]):
                 array[k + 1], array[k] = array[k], array[k + 1]
 
 
-def counting_sort(array, order=0):
+def counting_sort(array, order=0, key=None, reverse=False):
     """Counting sort"""
+    if reverse and order == 0:
+        order = -1
+    if key is not None or isinstance(array, pyarray.array):
+        if len(array) > 1:
+            keys = array if key is None else [key(item) for item in array]
+            if key is None:
+                counting_sort_values(array, min(keys), max(keys), order != 0)
+            else:
+                counting_sort_by_key(array, keys, min(keys), max(keys),
+                                     order != 0)
+        return
     frequencies = []
     for k in array:
         if k >= len(frequencies):
@@ -108,6 +830,142 @@ def counting_sort(array, order=0):
             order -= frequency
 
 
+def store(array, values):
+    """ Replace contents of list, array.array or numpy array"""
+    if isinstance(array, pyarray.array):
+        array[:] = pyarray.array(array.typecode, values)
+    else:
+        array[:] = values
+
+
+def key_offsets(keys, low, high, reverse):
+    """ Non-negative offsets of keys, descending keys first if reverse"""
+    offsets = [high - k for k in keys] if reverse else [k - low for k in keys]
+    if high - low < 2**64:
+        return pyarray.array('Q', offsets)
+    return offsets
+
+
+def counting_sort_by_key(array, keys, low, high, reverse):
+    """ Stable counting sort of array by integer keys in [low, high]"""
+    offsets = key_offsets(keys, low, high, reverse)
+    positions = [0]*(high - low + 2)
+    for offset in offsets:
+        positions[offset + 1] += 1
+    positions = list(itertools.accumulate(positions))
+    result = [None]*len(array)
+    for item, offset in zip(array, offsets):
+        result[positions[offset]] = item
+        positions[offset] += 1
+    store(array, result)
+
+
+def counting_sort_values(array, low, high, reverse):
+    """ Counting sort of integers in [low, high]"""
+    frequencies = [0]*(high - low + 1)
+    for value in array:
+        frequencies[value - low] += 1
+    values = range(low, high + 1)
+    if reverse:
+        values = reversed(values)
+        frequencies.reverse()
+    store(array, list(itertools.chain.from_iterable(
+        itertools.repeat(value, frequency)
+        for value, frequency in zip(values, frequencies) if frequency)))
+
+
+def radix_sort(array, key=None, reverse=False):
+    """LSD radix sort"""
+    if len(array) > 1:
+        radix_sort_by_keys(array, array if key is None else
+                           [key(item) for item in array], key is not None,
+                           reverse)
+
+
+def radix_sort_by_keys(array, keys, by_key, reverse):
+    """ Stable LSD radix sort of array by integer keys"""
+    size = len(array)
+    low, high = min(keys), max(keys)
+    offsets = key_offsets(keys, low, high, reverse)
+#    sort offsets themselves or, if there is key, indices of items
+    source = pyarray.array('Q', range(size)) if by_key else offsets
+    target = source[:]
+    mask = (1 << RADIX_BITS) - 1
+    for shift in range(0, max((high - low).bit_length(), 1), RADIX_BITS):
+        if by_key:
+            digits = [(offsets[index] >> shift) & mask for index in source]
+        else:
+            digits = [(offset >> shift) & mask for offset in source]
+        positions = [0]*(mask + 2)
+        for digit in digits:
+            positions[digit + 1] += 1
+        if max(positions) == size:
+            continue
+        positions = list(itertools.accumulate(positions))
+        for digit, value in zip(digits, source):
+            target[positions[digit]] = value
+            positions[digit] += 1
+        source, target = target, source
+    if by_key:
+        store(array, [array[index] for index in source])
+    elif reverse:
+        store(array, [high - offset for offset in source])
+    else:
+        store(array, [low + offset for offset in source])
+
+
+def numpy_integer_sort(array, keys, reverse):
+    """ Integer sort by numpy, False if keys don't fit int64"""
+    try:
+        if isinstance(keys, (numpy.ndarray, pyarray.array)):
+            values = numpy.asarray(keys)
+        else:
+            values = numpy.fromiter(keys, numpy.int64, len(keys))
+    except OverflowError:
+        return False
+    if values.dtype.kind not in 'iu':
+        return False
+    if keys is not array:
+        if reverse:
+#            stable descending order: ties keep their original order
+            order = len(values) - 1 - \
+                numpy.argsort(values[::-1], kind='stable')[::-1]
+        else:
+            order = numpy.argsort(values, kind='stable')
+        store(array, [array[index] for index in order.tolist()])
+        return True
+    low, high = int(values.min()), int(values.max())
+#    offsets are counted as int64, narrow types would wrap around
+    if high - low < COUNTING_SORT_DENSITY*len(values) and high < 2**63:
+        result = numpy.repeat(numpy.arange(low, high + 1, dtype=values.dtype),
+                              numpy.bincount(values.astype(numpy.int64) - low))
+    else:
+        result = numpy.sort(values, kind='stable')
+    if reverse:
+        result = result[::-1]
+    store(array, result if isinstance(array, numpy.ndarray)
+          else result.tolist())
+    return True
+
+
+def integer_sort(array, key=None, reverse=False, use_numpy=True):
+    """Integer sort"""
+    size = len(array)
+    if size < 2:
+        return
+    keys = array if key is None else [key(item) for item in array]
+    if use_numpy and numpy is not None and size >= NUMPY_SORT_CUTOFF and \
+            numpy_integer_sort(array, keys, reverse):
+        return
+    low, high = min(keys), max(keys)
+    if high - low >= COUNTING_SORT_DENSITY*size:
+        radix_sort_by_keys(array, keys, key is not None, reverse)
+    elif key is None:
+        counting_sort_values(array, low, high, reverse)
+    else:
+        counting_sort_by_key(array, keys, low, high, reverse)
+
+
 def check_sorted(array, compare=lambda x, y: x < y):
     """Check if array is sorted"""
     for i in range(len(array) - 1):
@@ -165,6 +1023,20 @@ def test_sort():
         quick_sort(A, compare, get_last_element),
         lambda A, compare=lambda x, y: x < y:
         quick_sort(A, compare, get_middle_element),
+        lambda A, compare=lambda x, y: x < y:
+        quick_sort(A, compare, get_start_element, introsort=True),
+        intro_sort,
+        lambda A, compare=lambda x, y: x < y:
+        intro_sort(A, compare, get_median_of_three),
+#        pivot selectors of three arguments are still supported
+        lambda A, compare=lambda x, y: x < y:
+        quick_sort(A, compare, lambda B, start, end: B[(start + end)//2]),
+        lambda A, compare=lambda x, y: x < y:
+        quick_sort(A, compare, lambda B, start, end, depth=0: B[start]),
+        lambda A, compare=lambda x, y: x < y:
+        intro_sort(A, compare, lambda B, start, end: B[end - 1]),
+        heap_sort,
+        merge_sort,
         insertion_sort,
         choice_sort,
         bubble_sort,
@@ -223,6 +1095,265 @@ def test_sort():
         print()
 
 
+def test_intro_sort():
+    """Test introsort on large and adversarial arrays"""
+    size = 20000
+    arrays = [
+        list(range(size)),
+        list(range(size, 0, -1)),
+        [k % 7 for k in range(size)],
+        list(range(size//2)) + list(range(size//2, 0, -1)),
+        [(k*7919) % size for k in range(size)]
+    ]
+    for array in arrays:
+        expected = sorted(array)
+        for pivot_fn in (get_start_element, get_last_element,
+                         get_middle_element, get_median_of_three,
+                         get_ninther):
+            sorted_array = array.copy()
+            intro_sort(sorted_array, pivot_fn=pivot_fn)
+            print(pivot_fn.__doc__, ":", "passed"
+                  if sorted_array == expected else "failed")
+            assert sorted_array == expected
+        reverse_sorted_array = array.copy()
+        intro_sort(reverse_sorted_array, lambda x, y: x > y)
+        assert reverse_sorted_array == expected[::-1]
+
+
+def test_key_sort():
+    """Test key, reverse and typed array paths of sorts"""
+    rnd = random.Random(23)
+    words = ["".join(rnd.choice("abc") for _ in range(rnd.randrange(6)))
+             for _ in range(300)]
+    stable_sorts = [insertion_sort, bubble_sort]
+    sorts = stable_sorts + [
+        quick_sort, choice_sort,
+        lambda array, compare=operator.lt, key=None, reverse=False:
+        quick_sort(array, compare, get_ninther, introsort=True, key=key,
+                   reverse=reverse)
+    ]
+    calls = [0]
+
+    def length(word):
+        calls[0] += 1
+        return len(word)
+    for sort in sorts:
+        for reverse in (False, True):
+            expected = sorted(words, key=len, reverse=reverse)
+            array = words.copy()
+            calls[0] = 0
+            sort(array, key=length, reverse=reverse)
+            assert calls[0] == len(words)
+            if sort in stable_sorts:
+                assert array == expected
+            else:
+                assert [len(word) for word in array] == \
+                    [len(word) for word in expected]
+                assert sorted(array) == sorted(words)
+            array = words.copy()
+            sort(array, lambda x, y: x > y, key=len, reverse=reverse)
+            assert [len(word) for word in array] == \
+                [len(word) for word in expected[::-1]]
+            array = words.copy()
+            sort(array, reverse=reverse)
+            assert array == sorted(words, reverse=reverse)
+        for typecode, values in (
+                ('q', [rnd.randrange(-10**15, 10**15) for _ in range(300)]),
+                ('B', [rnd.randrange(256) for _ in range(300)]),
+                ('d', [rnd.uniform(-1e6, 1e6) for _ in range(298)] +
+                 [0.0, -0.0, float('inf'), -float('inf')]),
+                ('f', [rnd.uniform(-1e3, 1e3) for _ in range(300)])):
+            for reverse in (False, True):
+                array = pyarray.array(typecode, values)
+                sort(array, reverse=reverse)
+                assert array.tolist() == sorted(
+                    pyarray.array(typecode, values), reverse=reverse)
+            array = pyarray.array(typecode, values)
+            sort(array, key=abs)
+            assert [abs(value) for value in array] == sorted(
+                abs(value) for value in pyarray.array(typecode, values))
+    integers = [rnd.randrange(50) for _ in range(300)]
+    array = integers.copy()
+    counting_sort(array, reverse=True)
+    assert array == sorted(integers, reverse=True)
+    array = pyarray.array('H', integers)
+    counting_sort(array)
+    assert array.tolist() == sorted(integers)
+    array = integers.copy()
+    counting_sort(array, key=lambda x: -x)
+    assert array == sorted(integers, reverse=True)
+    print("key sort : passed")
+
+
+def test_merge_sort():
+    """Test stability and adaptivity of merge sort"""
+    rnd = random.Random(20)
+    size = 20000
+    presorted = sorted(rnd.randrange(size) for _ in range(size))
+    nearly_sorted = presorted.copy()
+    for _ in range(size//100):
+        nearly_sorted[rnd.randrange(size)] = rnd.randrange(size)
+    arrays = [
+        [rnd.randrange(100) for _ in range(size)],
+        presorted,
+        presorted[::-1],
+        nearly_sorted,
+        presorted[size//3:] + presorted[:size//3],
+        list(itertools.chain.from_iterable(
+            sorted(rnd.randrange(1000) for _ in range(rnd.randrange(1, 500)))
+            for _ in range(100)))
+    ]
+    for array in arrays:
+        records = [(value, index) for index, value in enumerate(array)]
+        merge_sort(records, lambda x, y: x[0] < y[0])
+        assert records == sorted(records)
+        records = [(value, index) for index, value in enumerate(array)]
+        merge_sort(records, lambda x, y: x[0] > y[0])
+        assert records == sorted(records, key=lambda x: (-x[0], x[1]))
+    comparisons = [0]
+
+    def compare(lhs, rhs):
+        comparisons[0] += 1
+        return lhs < rhs
+    for array in (list(range(size)), list(range(size, 0, -1))):
+        comparisons[0] = 0
+        merge_sort(array, compare)
+        assert comparisons[0] == size - 1
+    print("merge sort : passed")
+
+
+def test_heap():
+    """Test Heap, IndexedHeap and d-ary heap sort"""
+    rnd = random.Random(21)
+    values = [rnd.randrange(1000) for _ in range(3000)]
+    for arity in (2, 3, 4, 8):
+        for typecode in (None, 'q'):
+            heap = Heap(values[:1000], arity=arity, typecode=typecode)
+            for value in values[1000:2000]:
+                heap.push(value)
+            assert heap.peek() == min(values[:2000])
+            popped = [heap.pop() for _ in range(len(heap))]
+            assert popped == sorted(values[:2000])
+        heap = Heap(values, lambda x, y: x > y, arity)
+        assert [heap.pop() for _ in range(10)] == sorted(values)[::-1][:10]
+        array = values.copy()
+        heap_sort(array, arity=arity)
+        assert array == sorted(values)
+        array = values.copy()
+        heap_sort(array, lambda x, y: x > y, 100, 2000, arity)
+        assert array == values[:100] + sorted(values[100:2000])[::-1] + \
+            values[2000:]
+    heap = Heap([5, 3, 8])
+    assert heap.pushpop(1) == 1
+    assert heap.pushpop(4) == 3
+    assert heap.replace(0) == 4
+    assert [heap.pop() for _ in range(len(heap))] == [0, 5, 8]
+    for arity in (2, 4):
+        indexed = IndexedHeap(arity=arity, typecode='d')
+        keys = {}
+        for item in range(500):
+            keys[item] = rnd.uniform(0, 1000)
+            indexed.push(item, keys[item])
+        for item in rnd.sample(range(500), 200):
+            keys[item] = keys[item] - rnd.uniform(0, 1000)
+            indexed.decrease_key(item, keys[item])
+        assert 7 in indexed and indexed.key(7) == keys[7]
+        popped = [indexed.pop() for _ in range(len(indexed))]
+        assert popped == sorted(keys.items(), key=lambda pair: pair[1])
+        assert 7 not in indexed
+    print("heap : passed")
+
+
+def test_selection():
+    """Test nth_element, quickselect, partial_sort and top_k"""
+    rnd = random.Random(19)
+    arrays = [
+        [rnd.randrange(1000) for _ in range(5000)],
+        [rnd.randrange(10) for _ in range(5000)],
+        list(range(5000)),
+        list(range(5000, 0, -1)),
+        [],
+        [1]
+    ]
+    for array in arrays:
+        expected = sorted(array)
+        nths = sorted({0, len(array)//3, len(array) - 1}) if array else []
+        for nth in nths:
+            for pivot_fn in (get_start_element, get_middle_element,
+                             get_ninther):
+                selected = array.copy()
+                nth_element(selected, nth, pivot_fn=pivot_fn)
+                assert selected[nth] == expected[nth]
+                assert all(value <= selected[nth]
+                           for value in selected[:nth])
+                assert all(value >= selected[nth]
+                           for value in selected[nth + 1:])
+            assert quickselect(array, nth) == expected[nth]
+            assert quickselect(iter(array), nth, lambda x, y: x > y) == \
+                expected[::-1][nth]
+        for k in (0, 1, 10, len(array), len(array) + 5):
+            assert top_k(array, k) == expected[:k]
+            assert top_k_stream(iter(array), k) == expected[:k]
+            assert top_k_stream(array, k, lambda x, y: x > y) == \
+                expected[::-1][:k]
+            partially_sorted = array.copy()
+            middle = min(k, len(array))
+            partial_sort(partially_sorted, middle)
+            assert partially_sorted[:middle] == expected[:middle]
+            assert sorted(partially_sorted) == expected
+    print("selection : passed")
+
+
+def test_integer_sort():
+    """Test integer sorts"""
+    rnd = random.Random(1)
+    arrays = [
+        [],
+        [5],
+        [3, -1, 2, -1, 0],
+        [rnd.randrange(-50, 50) for _ in range(1000)],
+        [rnd.randrange(-2**63, 2**63) for _ in range(1000)],
+        [rnd.randrange(2**70) for _ in range(300)],
+        [2**40, -2**40, 0, 2**40]
+    ]
+    for unsorted_array in arrays:
+        for reverse in (False, True):
+            expected = sorted(unsorted_array, reverse=reverse)
+            for sort_algorithm in (integer_sort, radix_sort):
+                sorted_array = unsorted_array.copy()
+                sort_algorithm(sorted_array, reverse=reverse)
+                assert sorted_array == expected
+            if all(-2**63 <= k < 2**63 for k in unsorted_array):
+                typed_array = pyarray.array('q', unsorted_array)
+                integer_sort(typed_array, reverse=reverse, use_numpy=False)
+                assert typed_array.tolist() == expected
+#            stability: sort pairs by their first element only
+            pairs = [(k, i) for i, k in enumerate(unsorted_array)]
+            expected = sorted(pairs, key=lambda pair: pair[0],
+                              reverse=reverse)
+            for sort_algorithm in (integer_sort, radix_sort):
+                sorted_pairs = pairs.copy()
+                sort_algorithm(sorted_pairs, lambda pair: pair[0], reverse)
+                assert sorted_pairs == expected
+        print(len(unsorted_array), "integers : passed")
+    if numpy is not None:
+        size = NUMPY_SORT_CUTOFF*2
+        for typecode, low, high in (('b', -128, 128), ('h', -2**15, 2**15),
+                                    ('B', 0, 256), ('Q', 0, 1000),
+                                    ('Q', 2**64 - 1000, 2**64),
+                                    ('Q', 0, 2**64), ('q', -1000, 1000)):
+            for reverse in (False, True):
+                values = [rnd.randrange(low, high) for _ in range(size)]
+                expected = sorted(values, reverse=reverse)
+                typed_array = pyarray.array(typecode, values)
+                integer_sort(typed_array, reverse=reverse)
+                assert typed_array.tolist() == expected
+                numpy_array = numpy.array(values, numpy.dtype(typecode))
+                integer_sort(numpy_array, reverse=reverse)
+                assert numpy_array.tolist() == expected
+        print("numpy integers : passed")
+
+
 def is_prime_number_brute_force(number):
     """check whether n is prime"""
     for divisor in range(2, number):
@@ -235,15 +1366,157 @@ def eratosthenes_sieve(up_to):
     """ Calculates Eratosthenes sieve"""
     sieve = [True]*(up_to + 1)
     sieve[0] = sieve[1] = False
-    for k in range(2, len(sieve)):
+    for k in range(2, math.isqrt(up_to) + 1):
         if sieve[k]:
-            for i in range(2*k, len(sieve), k):
-                sieve[i] = False
+            sieve[k*k::k] = [False]*len(range(k*k, len(sieve), k))
     while not sieve[-1]:
         sieve.pop()
     return sieve
 
 
+def primes_between(low, high, segment=SIEVE_SEGMENT):
+    """ Generates primes in [low, high) by segmented sieve of odd numbers"""
+    if low <= 2 < high:
+        yield 2
+    low = max(low, 3) | 1
+    if low >= high:
+        return
+    base = list(primes_between(3, math.isqrt(high - 1) + 1, segment))
+    for segment_low in range(low, high, 2*segment):
+        segment_high = min(segment_low + 2*segment, high)
+#        flags[i] is for segment_low + 2*i
+        count = (segment_high - segment_low + 1)//2
+        flags = bytearray(b'\x01')*count
+        for prime in base:
+            first = prime*prime
+            if first >= segment_high:
+                break
+            first = max(first, -(-segment_low//prime)*prime)
+            if first % 2 == 0:
+                first += prime
+            i = (first - segment_low)//2
+            flags[i::prime] = bytes(len(range(i, count, prime)))
+        yield from itertools.compress(range(segment_low, segment_high, 2),
+                                      flags)
+
+
+def primes(up_to):
+    """ Generates primes up to up_to inclusive"""
+    return primes_between(2, up_to + 1)
+
+
+SMALL_PRIMES = tuple(primes(SMALL_PRIMES_LIMIT))
+
+
+def miller_rabin(number, bases):
+    """ Whether odd number > 2 is strong probable prime to all bases"""
+    odd = number - 1
+    twos = (odd & -odd).bit_length() - 1
+    odd >>= twos
+    for base in bases:
+        base %= number
+        if base == 0:
+            continue
+        power = pow(base, odd, number)
+        if power in (1, number - 1):
+            continue
+        for _ in range(twos - 1):
+            power = power*power % number
+            if power == number - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def jacobi(numerator, denominator):
+    """ Jacobi symbol of numerator over odd positive denominator"""
+    numerator %= denominator
+    result = 1
+    while numerator:
+        while numerator % 2 == 0:
+            numerator //= 2
+            if denominator % 8 in (3, 5):
+                result = -result
+        numerator, denominator = denominator, numerator
+        if numerator % 4 == 3 and denominator % 4 == 3:
+            result = -result
+        numerator %= denominator
+    return result if denominator == 1 else 0
+
+
+def strong_lucas(number):
+    """ Whether odd number > 2 is strong Lucas probable prime,
+        parameters chosen by Selfridge's method A"""
+    if math.isqrt(number)**2 == number:
+        return False
+    discriminant = 5
+    while jacobi(discriminant, number) != -1:
+        if jacobi(discriminant, number) == 0 and \
+                abs(discriminant) != number:
+            return False
+        discriminant = -discriminant - 2 if discriminant > 0 \
+            else -discriminant + 2
+    q_value = (1 - discriminant) // 4
+    odd = number + 1
+    twos = (odd & -odd).bit_length() - 1
+    odd >>= twos
+#    U and V of Lucas sequences with P = 1 at odd, by binary expansion
+    u_value, v_value, q_power = 1, 1, q_value % number
+    for bit in bin(odd)[3:]:
+        u_value, v_value = u_value*v_value % number, \
+            (v_value*v_value - 2*q_power) % number
+        q_power = q_power*q_power % number
+        if bit == '1':
+            u_value, v_value = u_value + v_value, \
+                discriminant*u_value + v_value
+            u_value = (u_value + number*(u_value & 1)) // 2 % number
+            v_value = (v_value + number*(v_value & 1)) // 2 % number
+            q_power = q_power*q_value % number
+    if u_value == 0 or v_value == 0:
+        return True
+    for _ in range(twos - 1):
+        v_value = (v_value*v_value - 2*q_power) % number
+        if v_value == 0:
+            return True
+        q_power = q_power*q_power % number
+    return False
+
+
+def is_prime(number):
+    """ Primality test, deterministic below MILLER_RABIN_LIMIT,
+        Baillie-PSW above it"""
+    if number < 2:
+        return False
+    for prime in SMALL_PRIMES:
+        if number % prime == 0:
+            return number == prime
+    if number < SMALL_PRIMES[-1]**2:
+        return True
+    if number >= MILLER_RABIN_LIMIT:
+        return miller_rabin(number, (2,)) and strong_lucas(number)
+    return miller_rabin(number, MILLER_RABIN_BASES_64 if number < 2**64
+                        else MILLER_RABIN_BASES)
+
+
+def is_prime_many(numbers):
+    """ Primality of every number, dense batches share one sieve"""
+    numbers = list(numbers)
+    if not numbers:
+        return []
+    low, high = min(numbers), max(numbers) + 1
+#    the sieve costs the span plus the base primes up to sqrt(high)
+    if high <= BATCH_SIEVE_LIMIT and high - low + math.isqrt(high) <= \
+            BATCH_SIEVE_DENSITY*len(numbers):
+        found = set(primes_between(low, high))
+        return [number in found for number in numbers]
+    known = {}
+    for number in numbers:
+        if number not in known:
+            known[number] = is_prime(number)
+    return [known[number] for number in numbers]
+
+
 def print_eratosthenes_sieve(up_to, width):
     """ Prints prime numbers table using Eratosthenes sieve"""
     sieve = eratosthenes_sieve(up_to)
@@ -264,20 +1537,58 @@ def test_primes():
     assert eratosthenes_sieve(100) != eratosthenes_sieve(101)
     print_eratosthenes_sieve(6000, 20)
     sieve = eratosthenes_sieve(1000)
-    for number, is_prime in enumerate(sieve):
-        assert is_prime_number_brute_force(number) == is_prime
-
+    for number, prime in enumerate(sieve):
+        assert is_prime_number_brute_force(number) == prime
+    sieve = eratosthenes_sieve(100000)
+    expected = [number for number, prime in enumerate(sieve) if prime]
+    assert list(primes(100000)) == expected
+    assert list(primes(len(sieve) - 1)) == expected
+    assert list(primes(1)) == []
+    assert list(primes(2)) == [2]
+    prime_set = set(expected)
+    assert [is_prime(number) for number in range(-5, 100001)] == \
+        [number in prime_set for number in range(-5, 100001)]
+    assert is_prime_many(range(-5, 100001)) == \
+        [number in prime_set for number in range(-5, 100001)]
+    pseudoprimes = [561, 3215031751, 3825123056546413051,
+                    318665857834031151167461, 2**64 - 57, 2**61 - 3,
+                    (2**61 - 1)*(2**31 - 1), 1000000007*1000000009,
+                    MILLER_RABIN_LIMIT, (2**89 - 1)*(2**61 - 1)]
+    large_primes = [2**31 - 1, 2**61 - 1, 2**64 - 59, 2**89 - 1,
+                    1000000007, 1000000009, 2**127 - 1, 2**521 - 1]
+    assert not any(is_prime(number) for number in pseudoprimes)
+    assert all(is_prime(number) for number in large_primes)
+#    smallest strong Lucas pseudoprimes, caught by base 2 test of BPSW
+    assert all(strong_lucas(number) and not is_prime(number)
+               for number in (5459, 5777, 10877, 16109, 18971))
+    assert is_prime_many(pseudoprimes + large_primes) == \
+        [False]*len(pseudoprimes) + [True]*len(large_primes)
+    for low, high in ((0, 100), (2, 3), (3, 4), (90, 97), (90, 98),
+                      (1000, 30000), (99990, 100000)):
+        for segment in (1, 7, 64, SIEVE_SEGMENT):
+            assert list(primes_between(low, high, segment)) == \
+                [prime for prime in expected if low <= prime < high]
 
-WINDOW = graphics.GraphWin("Test", 300, 300)
 
 TESTS = [
     test_primes,
     test_check_sorted,
-    test_sort
+    test_sort,
+    test_intro_sort,
+    test_key_sort,
+    test_merge_sort,
+    test_heap,
+    test_selection,
+    test_integer_sort
 ]
 
-for test in TESTS:
-    print("-"*20, test.__doc__)
-    test()
-    print("-"*40)
-    print()
+if __name__ == "__main__":
+    import graphics
+
+    WINDOW = graphics.GraphWin("Test", 300, 300)
+
+    for test in TESTS:
+        print("-"*20, test.__doc__)
+        test()
+        print("-"*40)
+        print()
@@ -0,0 +1,201 @@
+""" Benchmark of algo sorting and prime numbers routines """
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import algo
+import sample_sort
+
+
+def random_input(size, rnd):
+    """ Random values"""
+    return [rnd.randrange(size) for _ in range(size)]
+
+
+def sorted_input(size, _rnd):
+    """ Sorted values"""
+    return list(range(size))
+
+
+def reversed_input(size, _rnd):
+    """ Reverse sorted values"""
+    return list(range(size, 0, -1))
+
+
+def few_unique_input(size, rnd):
+    """ Random values out of 10 distinct ones"""
+    return [rnd.randrange(10) for _ in range(size)]
+
+
+def organ_pipe_input(size, _rnd):
+    """ Ascending then descending values"""
+    return list(range(size//2)) + list(range(size - size//2, 0, -1))
+
+
+INPUTS = {
+    "random": random_input,
+    "sorted": sorted_input,
+    "reversed": reversed_input,
+    "few_unique": few_unique_input,
+    "organ_pipe": organ_pipe_input
+}
+
+
+def pivot_quick_sort(pivot_fn):
+    """ quick_sort with given pivot selection"""
+    return lambda array, compare: algo.quick_sort(array, compare, pivot_fn)
+
+
+# name: (sort function taking array and compare, largest size by default)
+SORTS = {
+    "quick_sort/start": (pivot_quick_sort(algo.get_start_element), 10**6),
+    "quick_sort/last": (pivot_quick_sort(algo.get_last_element), 10**6),
+    "quick_sort/middle": (pivot_quick_sort(algo.get_middle_element), 10**6),
+    "quick_sort/median_of_three": (
+        pivot_quick_sort(algo.get_median_of_three), 10**6),
+    "quick_sort/ninther": (pivot_quick_sort(algo.get_ninther), 10**6),
+    "merge_sort": (algo.merge_sort, 10**6),
+    "insertion_sort": (algo.insertion_sort, 10**4),
+    "choice_sort": (algo.choice_sort, 10**4),
+    "bubble_sort": (algo.bubble_sort, 10**4),
+    "counting_sort": (lambda array, _compare: algo.counting_sort(array),
+                      10**7),
+    "integer_sort": (lambda array, _compare: algo.integer_sort(array),
+                     10**7),
+    "radix_sort": (lambda array, _compare: algo.radix_sort(array), 10**7),
+    "sample_sort": (lambda array, _compare: sample_sort.sample_sort(
+        array, 'q'), 10**8)
+}
+
+# name: (function taking size, largest size by default)
+PRIMES = {
+    "eratosthenes_sieve": (algo.eratosthenes_sieve, 10**7),
+    "primes": (lambda size: sum(1 for _ in algo.primes(size)), 10**8),
+    "is_prime": (lambda size: sum(map(algo.is_prime,
+                                      range(2**62, 2**62 + size))), 10**6)
+}
+
+COUNTED_SORTS = set(SORTS) - {"counting_sort", "integer_sort", "radix_sort",
+                              "sample_sort"}
+
+
+def measure(function, *args):
+    """ Wall clock time of function call"""
+    now = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - now
+
+
+def profile(function, *args):
+    """ Peak traced memory of function call"""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_sort(name, input_name, size, args):
+    """ Benchmark one sort on one input"""
+    sort, _ = SORTS[name]
+    array = INPUTS[input_name](size, random.Random(args.seed))
+    expected = sorted(array)
+    result = {"algorithm": name, "input": input_name, "size": size}
+    comparisons = [0]
+
+    def compare(lhs, rhs):
+        comparisons[0] += 1
+        return lhs < rhs
+
+    work = array.copy()
+    result["seconds"] = measure(sort, work, lambda x, y: x < y)
+    assert work == expected
+    if args.profile:
+        if name in COUNTED_SORTS:
+            sort(array.copy(), compare)
+            result["comparisons"] = comparisons[0]
+        else:
+            result["comparisons"] = None
+        result["peak_bytes"] = profile(sort, array.copy(),
+                                       lambda x, y: x < y)
+    return result
+
+
+def bench_primes(name, size, args):
+    """ Benchmark one prime numbers routine"""
+    function, _ = PRIMES[name]
+    result = {"algorithm": name, "input": None, "size": size,
+              "seconds": measure(function, size)}
+    if args.profile:
+        result["comparisons"] = None
+        result["peak_bytes"] = profile(function, size)
+    return result
+
+
+def run(args):
+    """ Run selected benchmarks, returns list of results"""
+    results = []
+    for name in args.algorithms:
+        limit = args.max_size or (SORTS.get(name) or PRIMES[name])[1]
+        for input_name in (args.inputs if name in SORTS else [None]):
+            for size in args.sizes:
+                if size > limit:
+                    continue
+                try:
+                    if name in SORTS:
+                        result = bench_sort(name, input_name, size, args)
+                    else:
+                        result = bench_primes(name, size, args)
+                except RecursionError as error:
+                    result = {"algorithm": name, "input": input_name,
+                              "size": size, "error": repr(error)}
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+                if "error" in result or result["seconds"] > args.budget:
+                    break
+    return results
+
+
+def main():
+    """ Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--algorithms", nargs="+",
+                        default=list(SORTS) + list(PRIMES),
+                        choices=list(SORTS) + list(PRIMES))
+    parser.add_argument("--inputs", nargs="+", default=list(INPUTS),
+                        choices=list(INPUTS))
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[10**k for k in range(3, 8)])
+    parser.add_argument("--max-size", type=int, default=None,
+                        help="override per algorithm size limits")
+    parser.add_argument("--budget", type=float, default=60.0,
+                        help="skip larger sizes after a run this long")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-profile", dest="profile",
+                        action="store_false",
+                        help="skip comparison count and memory runs")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "results": run(args)
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+""" Out-of-core parallel external merge sort """
+
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import mmap
+import operator
+import os
+import random
+import struct
+import tempfile
+
+import algo
+
+
+CHUNK_RECORDS = 1 << 20
+
+
+def record_struct(record_format):
+    """ struct of packed record, little endian unless format tells"""
+    if record_format[:1] not in ('@', '=', '<', '>', '!'):
+        record_format = '<' + record_format
+    return struct.Struct(record_format)
+
+
+def is_single(packer):
+    """ Whether records are plain values rather than tuples"""
+    return len(packer.unpack(bytes(packer.size))) == 1
+
+
+def unpack_records(packer, data):
+    """ Iterate over records packed into data"""
+    if is_single(packer):
+        return (record[0] for record in packer.iter_unpack(data))
+    return packer.iter_unpack(data)
+
+
+def pack_records(packer, records):
+    """ Pack records into bytes"""
+    if is_single(packer):
+        return b''.join(map(packer.pack, records))
+    return b''.join(itertools.starmap(packer.pack, records))
+
+
+def reversed_compare(compare, lhs, rhs):
+    """ compare with arguments swapped, picklable by functools.partial"""
+    return compare(rhs, lhs)
+
+
+def sort_run(chunk, record_format, compare, reverse, directory):
+    """ Sort packed records by algo.intro_sort, spill them to run file"""
+    packer = record_struct(record_format)
+    records = list(unpack_records(packer, chunk))
+    if compare is None:
+        compare = (lambda x, y: x > y) if reverse else (lambda x, y: x < y)
+    algo.intro_sort(records, compare)
+    with tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.run',
+                                     delete=False) as run:
+        run.write(pack_records(packer, records))
+    return run.name
+
+
+def read_chunks(records, packer, chunk_records):
+    """ Packed chunks of records read from file, path or iterable"""
+    if isinstance(records, (str, bytes, os.PathLike)):
+        with open(records, 'rb') as source:
+            yield from read_chunks(source, packer, chunk_records)
+        return
+    if hasattr(records, 'read'):
+        while True:
+            chunk = records.read(chunk_records*packer.size)
+            if not chunk:
+                return
+            if len(chunk) % packer.size:
+                raise ValueError("truncated record at the end of input")
+            yield chunk
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_records))
+        if not chunk:
+            return
+        yield pack_records(packer, chunk)
+
+
+def spill_runs(records, record_format, chunk_records, compare, reverse,
+               workers, directory):
+    """ Sort chunks of records into run files, returns their paths"""
+    packer = record_struct(record_format)
+    if workers == 0:
+        return [sort_run(chunk, record_format, compare, reverse, directory)
+                for chunk in read_chunks(records, packer, chunk_records)]
+    if workers is None:
+        workers = os.cpu_count()
+    runs = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for chunk in read_chunks(records, packer, chunk_records):
+#            keep at most two chunks per worker in memory
+            if len(pending) >= 2*workers:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                runs.extend(future.result() for future in done)
+            pending.add(pool.submit(sort_run, chunk, record_format, compare,
+                                    reverse, directory))
+        runs.extend(future.result() for future in pending)
+    return runs
+
+
+def external_sort(records, record_format='q', chunk_records=CHUNK_RECORDS,
+                  compare=None, reverse=False, workers=None, directory=None):
+    """ Generate records sorted in memory bounded by chunk_records"""
+#    records are values (tuples for multi-field formats), binary file or
+#    path of file packed by record_format; chunks are sorted by a pool of
+#    processes (in this one if workers is 0), so compare must be picklable
+    if compare is not None and reverse:
+        compare = functools.partial(reversed_compare, compare)
+        reverse = False
+    packer = record_struct(record_format)
+    with tempfile.TemporaryDirectory(dir=directory) as temporary:
+        runs = spill_runs(records, record_format, chunk_records, compare,
+                          reverse, workers, temporary)
+        maps = []
+        try:
+            for run in runs:
+                if os.path.getsize(run) == 0:
+                    continue
+                with open(run, 'rb') as source:
+                    maps.append(mmap.mmap(source.fileno(), 0,
+                                          access=mmap.ACCESS_READ))
+            key = None
+            if compare is not None:
+                key = functools.cmp_to_key(
+                    lambda x, y: -1 if compare(x, y) else int(compare(y, x)))
+            merged = heapq.merge(*(unpack_records(packer, run)
+                                   for run in maps),
+                                 key=key, reverse=reverse and key is None)
+            yield from merged
+        finally:
+            merged = None
+            for run in maps:
+                try:
+                    run.close()
+                except BufferError:
+                    pass
+
+
+def test_external_sort():
+    """Test external sort"""
+    rnd = random.Random(2)
+    values = [rnd.randrange(-1000, 1000) for _ in range(10000)]
+    for workers, chunk_records in ((0, 1), (0, 999), (2, 999), (2, 10000),
+                                   (2, 20000)):
+        assert list(external_sort(values, chunk_records=chunk_records,
+                                  workers=workers)) == sorted(values)
+    assert list(external_sort(values, chunk_records=777, reverse=True,
+                              workers=0)) == sorted(values, reverse=True)
+    assert list(external_sort(
+        values, chunk_records=777, compare=lambda x, y: x > y,
+        workers=0)) == sorted(values, reverse=True)
+    for workers in (0, 2):
+        assert list(external_sort(
+            values, chunk_records=777, compare=operator.lt, reverse=True,
+            workers=workers)) == sorted(values, reverse=True)
+    rows = [(rnd.randrange(100), rnd.random()) for _ in range(5000)]
+    assert list(external_sort(rows, 'qd', 300, workers=2)) == sorted(rows)
+    with tempfile.TemporaryFile() as source:
+        source.write(b''.join(struct.pack('<q', value) for value in values))
+        source.seek(0)
+        assert list(external_sort(source, chunk_records=1234,
+                                  workers=0)) == sorted(values)
+    assert not list(external_sort([], workers=0))
+    print("external sort : passed")
+
+
+if __name__ == "__main__":
+    test_external_sort()
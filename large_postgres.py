@@ -1,10 +1,26 @@
 """ Test postgresql table with ~100M records / 2.5G in size """
 
+import array
+import asyncio
+import collections
+import concurrent.futures
+import csv
+import ipaddress
+import json
+import os
 import random
 import string
+import struct
+import sys
+import tempfile
 import time
 import rapidpg
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def generate_host(length):
     """Generate random host name"""
@@ -27,14 +43,62 @@ NTLDS = len(TLDS)
 NHOSTS = 100
 IP_BASE = 10*2**24 + 1
 NIPS = 2**24 - 2
-HOSTS = [
-    (NTLDS*(1 + 2*i),
-     NTLDS*(2 + 2*i),
-     IP_BASE + random.randrange(0, IP_ADDRESSES),
-     1 + (i % len(SERVICES)),
-     random.uniform(0.0, 1000.0),
-     random.uniform(0.0, 1000.0)
-     ) for i in range(NHOSTS//2)]
+SEED = 0
+
+
+def make_hosts(seed):
+    """ host table, the same for the same seed on every machine """
+    rnd = random.Random(seed)
+    return [
+        (NTLDS*(1 + 2*i),
+         NTLDS*(2 + 2*i),
+         IP_BASE + rnd.randrange(0, IP_ADDRESSES),
+         1 + (i % len(SERVICES)),
+         rnd.uniform(0.0, 1000.0),
+         rnd.uniform(0.0, 1000.0)
+         ) for i in range(NHOSTS//2)]
+
+
+HOSTS = make_hosts(SEED)
+
+TABLE = "large_conversations"
+COLUMNS = "host_from, host_to, ip_from, ip_to, service, inbound, outbound"
+COLUMN_TYPES = (rapidpg.Parameters.ColumnType.INT8,
+                rapidpg.Parameters.ColumnType.INT8,
+                rapidpg.Parameters.ColumnType.IP4_HBO,
+                rapidpg.Parameters.ColumnType.IP4_HBO,
+                rapidpg.Parameters.ColumnType.INT8,
+                rapidpg.Parameters.ColumnType.FLOAT8,
+                rapidpg.Parameters.ColumnType.FLOAT8)
+# array typecodes of columns, 8 bytes each as in Parameters
+COLUMN_TYPECODES = ('q', 'q', 'q', 'q', 'q', 'd', 'd')
+BLOCK_HEADER = struct.Struct('<Q')
+CHECKPOINT_TABLE = TABLE + "_checkpoint"
+# name: aggregate query run by the query benchmark
+QUERIES = {
+    "count": "SELECT count(*) FROM {0}",
+    "group_by_service": """
+        SELECT service, count(*), sum(inbound), sum(outbound)
+        FROM {0}
+        GROUP BY service""",
+    "top_host_pairs": """
+        SELECT host_from, host_to, sum(inbound + outbound) AS bytes
+        FROM {0}
+        GROUP BY host_from, host_to
+        ORDER BY bytes DESC
+        LIMIT 10""",
+    "inet_range": """
+        SELECT count(*), avg(inbound), avg(outbound)
+        FROM {0}
+        WHERE ip_from << inet '10.0.0.0/16'"""
+}
+PERCENTILES = (50, 95, 99)
+# batch sizes tried by autotuning, capped by parameters per statement
+AUTOTUNE_SIZES = (256, 512, 1024, 2048, 4096, 65535 // 7)
+AUTOTUNE_BATCHES = 3
+# load methods all server waits of which are timed by Instrumentation
+CLIENT_BOUND_METHODS = ("insert", "autotune", "pipeline", "replay",
+                        "checkpoint")
 
 
 def fill_in_parameters(parameters, i, to_i):
@@ -55,17 +119,493 @@ def fill_in_parameters(parameters, i, to_i):
         i += 1
 
 
-def add_records(conn, records, records_at_once, parameters):
-    """ todo """
-    i = records_at_once
-    while i < records:
+def column_block(i, to_i, hosts=None):
+    """ columns of records [i, to_i) as arrays, numpy ones if available """
+    if hosts is None:
+        hosts = HOSTS
+    if numpy is not None:
+        rows = numpy.arange(i, to_i, dtype=numpy.int64)
+        host = rows % len(hosts)
+        ip_from_index = rows // len(hosts)
+        host_from_index = ip_from_index // NIPS
+        fields = [numpy.array(field, dtype=typecode)[host]
+                  for field, typecode in zip(zip(*hosts), 'qqqqdd')]
+        return (fields[0] + host_from_index % NTLDS,
+                fields[1] + host_from_index // NTLDS % NTLDS,
+                IP_BASE + ip_from_index % NIPS,
+                fields[2], fields[3], fields[4], fields[5])
+    rows = range(i, to_i)
+    row_hosts = [hosts[k % len(hosts)] for k in rows]
+    ip_from_indices = [k // len(hosts) for k in rows]
+    host_from_indices = [k // NIPS for k in ip_from_indices]
+    return tuple(array.array(typecode, column) for typecode, column in zip(
+        COLUMN_TYPECODES, (
+            [host[0] + (k % NTLDS)
+             for host, k in zip(row_hosts, host_from_indices)],
+            [host[1] + (k // NTLDS % NTLDS)
+             for host, k in zip(row_hosts, host_from_indices)],
+            [IP_BASE + k % NIPS for k in ip_from_indices],
+            [host[2] for host in row_hosts],
+            [host[3] for host in row_hosts],
+            [host[4] for host in row_hosts],
+            [host[5] for host in row_hosts])))
+
+
+def fill_in_columns(parameters, i, to_i):
+    """ fill in inserter parameters column by column """
+    parameters.add_columns(column_block(i, to_i), COLUMN_TYPES)
+
+
+def write_blocks(path, records, block_records, seed=SEED, file_format="bin"):
+    """ save records in blocks to binary or csv file for replay """
+    hosts = make_hosts(seed)
+    if file_format == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(column.strip() for column in COLUMNS.split(","))
+            for i in range(0, records, block_records):
+                columns = [list(column) for column in column_block(
+                    i, min(i + block_records, records), hosts)]
+                for index in (2, 3):
+                    columns[index] = [str(ipaddress.IPv4Address(int(value)))
+                                      for value in columns[index]]
+                writer.writerows(zip(*columns))
+        return
+    with open(path, "wb") as blocks:
+        for i in range(0, records, block_records):
+            columns = column_block(i, min(i + block_records, records), hosts)
+            blocks.write(BLOCK_HEADER.pack(len(columns[0])))
+            for typecode, column in zip(COLUMN_TYPECODES, columns):
+                column = array.array(typecode, column)
+                if sys.byteorder != "little":
+                    column.byteswap()
+                blocks.write(column.tobytes())
+
+
+def read_blocks(path, block_records):
+    """ generate column blocks saved by write_blocks """
+    # binary files keep blocks as written, csv ones are read by block_records
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as source:
+            reader = csv.reader(source)
+            if next(reader, None) is None:
+                return
+            while True:
+                rows = [row for _, row in zip(range(block_records), reader)]
+                if not rows:
+                    return
+                columns = list(zip(*rows))
+                yield tuple(array.array(typecode, (
+                    int(ipaddress.IPv4Address(value)) if index in (2, 3)
+                    else float(value) if typecode == "d" else int(value)
+                    for value in column)) for index, (typecode, column) in
+                            enumerate(zip(COLUMN_TYPECODES, columns)))
+    with open(path, "rb") as source:
+        while True:
+            header = source.read(BLOCK_HEADER.size)
+            if not header:
+                return
+            rows, = BLOCK_HEADER.unpack(header)
+            columns = []
+            for typecode in COLUMN_TYPECODES:
+                column = array.array(typecode)
+                column.frombytes(source.read(rows*column.itemsize))
+                if sys.byteorder != "little":
+                    column.byteswap()
+                columns.append(column)
+            yield tuple(columns)
+
+
+def check_result(conn, res):
+    """ raise RuntimeError unless statement succeeded, returns res """
+    if not res.has_result() or res.status() not in (
+            rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK,
+            rapidpg.Result.ExecStatusType.PGRES_TUPLES_OK):
+        raise RuntimeError(conn.error_message())
+    return res
+
+
+def execute_checked(conn, sql):
+    """ execute sql, raise RuntimeError unless it succeeded """
+    return check_result(conn, conn.execute(sql))
+
+
+def encode_columns(conn, parameters, i, to_i):
+    """ fill in parameters, timed if connection is instrumented """
+    if conn.instrumentation is None:
+        fill_in_columns(parameters, i, to_i)
+    else:
+        with conn.instrumentation.encoding():
+            fill_in_columns(parameters, i, to_i)
+
+
+def insert_batches(conn, parameters, start, records_at_once, batches):
+    """ insert batches of records from start, returns rows per second """
+    now = time.perf_counter()
+    for i in range(start, start + batches*records_at_once, records_at_once):
+        parameters.set_current(0)
+        encode_columns(conn, parameters, i, i + records_at_once)
+        check_result(conn, conn.exec_prepared("inserter", parameters))
+    return batches*records_at_once / (time.perf_counter() - now)
+
+
+def autotune_batch_size(conn, records, records_at_once, parameters, start=0,
+                        sizes=AUTOTUNE_SIZES, batches=AUTOTUNE_BATCHES):
+    """ insert first records at each candidate batch size,
+        leave inserter prepared for the fastest one,
+        returns it and the number of records inserted """
+    best, best_rate = records_at_once, 0.0
+    prepared = records_at_once
+    for size in sizes:
+        if size > records_at_once or start + size*(batches + 1) > records:
+            continue
+        if size != prepared:
+            prepare_inserter(conn, size)
+            prepared = size
+        # untimed batch plans the statement and warms up caches
+        insert_batches(conn, parameters, start, size, 1)
+        start += size
+        rate = insert_batches(conn, parameters, start, size, batches)
+        print("  batch of {} records --- {:.0f} records/s".format(size, rate))
+        start += size*batches
+        if rate > best_rate:
+            best, best_rate = size, rate
+    if best != prepared:
+        prepare_inserter(conn, best)
+    return best, start
+
+
+def add_records(conn, records, records_at_once, parameters, start=0,
+                autotune=False):
+    """ insert full batches of records [start, records),
+        returns batch size used and the end of the last batch """
+    if autotune:
+        records_at_once, start = autotune_batch_size(
+            conn, records, records_at_once, parameters, start)
+        print("  autotuned batch size:", records_at_once, "records")
+    i = start + records_at_once
+    while i <= records:
         parameters.set_current(0)
-        fill_in_parameters(parameters, i - records_at_once, i)
+        encode_columns(conn, parameters, i - records_at_once, i)
         conn.exec_prepared("inserter", parameters)
         i += records_at_once
+    return records_at_once, i - records_at_once
+
+
+def insert_statement(records_at_once):
+    """ INSERT statement for records_at_once rows """
+    return ("""
+        INSERT INTO {0}
+        ({1})
+        VALUES
+        """ + generate_insert_values(records_at_once, 7)).format(
+            TABLE, COLUMNS)
+
+
+def prepare_inserter(conn, records_at_once):
+    """ (re)prepare inserter statement for records_at_once rows """
+    if conn.is_prepared("inserter"):
+        check_result(conn, conn.deallocate("inserter"))
+    check_result(conn, conn.prepare("inserter",
+                                    insert_statement(records_at_once)))
+
+
+def insert_tail(conn, start, records, records_at_once, parameters):
+    """ insert records left after full batches, returns their number """
+    tail = (records - start) % records_at_once
+    if tail > 0:
+        encode_columns(conn, parameters, records - tail, records)
+        check_result(conn, conn.query(insert_statement(tail), parameters))
+    return tail
+
+
+def set_hosts(hosts):
+    """ share host table of the parent process with a worker """
+    HOSTS[:] = hosts
+
+
+def load_range(conn_params, start, end, records_at_once):
+    """ insert records [start, end) in own connection and transaction """
+    conn = rapidpg.Connection(conn_params)
+    assert conn.is_connected()
+    assert conn.status()
+    now = time.monotonic()
+    res = conn.execute("BEGIN TRANSACTION")
+    assert res.has_result()
+    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    parameters = rapidpg.Parameters()
+    prepare_inserter(conn, records_at_once)
+    add_records(conn, end, records_at_once, parameters, start)
+    insert_tail(conn, start, end, records_at_once, parameters)
+    res = conn.deallocate("inserter")
+    assert res.has_result()
+    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    res = conn.execute("COMMIT TRANSACTION")
+    assert res.has_result()
+    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    return start, end, time.monotonic() - now
+
+
+def table_rows(conn):
+    """ number of records in the table, -1 if there is no table """
+    res = execute_checked(conn, "SELECT to_regclass('{}')".format(TABLE))
+    if res.value(0, 0) is None:
+        return -1
+    res = execute_checked(conn, "SELECT count(*) FROM {}".format(TABLE))
+    return int(res.value(0, 0))
 
 
-def test_database(host, user, password, database, records):
+def read_checkpoint(conn, checkpoint_file=None):
+    """ number of records committed by previous checkpointed loads """
+    if checkpoint_file is None:
+        # UNLOGGED as the table it counts, so that crash recovery empties
+        # both; a checkpoint file outlives the records it counts then,
+        # load_from_checkpoint refuses to resume from it
+        execute_checked(conn, "CREATE UNLOGGED TABLE IF NOT EXISTS {} (name "
+                        "text PRIMARY KEY, loaded bigint NOT NULL)".format(
+                            CHECKPOINT_TABLE))
+        res = execute_checked(conn, "SELECT loaded FROM {} WHERE name = '{}'"
+                              .format(CHECKPOINT_TABLE, TABLE))
+        return int(res.value(0, 0)) if res.rowcount() else 0
+    if not os.path.exists(checkpoint_file):
+        return 0
+    with open(checkpoint_file, encoding="utf-8") as source:
+        loaded, pending, xid = (int(value) for value in source.read().split())
+    if pending > loaded:
+        # the process died between COMMIT and the file update
+        res = execute_checked(conn, "SELECT txid_status({})".format(xid))
+        if res.value(0, 0) == "committed":
+            loaded = pending
+    return loaded
+
+
+def save_checkpoint(conn, loaded, pending, checkpoint_file=None):
+    """ record records [loaded, pending) as committed by this transaction """
+    if checkpoint_file is None:
+        # committed together with the records it counts
+        execute_checked(conn, "INSERT INTO {0} (name, loaded) VALUES ('{1}', "
+                        "{2}) ON CONFLICT (name) DO UPDATE SET loaded = "
+                        "EXCLUDED.loaded".format(CHECKPOINT_TABLE, TABLE,
+                                                 pending))
+        return
+    xid = 0
+    if pending > loaded:
+        xid = int(execute_checked(conn, "SELECT txid_current()").value(0, 0))
+    temporary = checkpoint_file + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as checkpoint:
+        checkpoint.write("{} {} {}\n".format(loaded, pending, xid))
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.replace(temporary, checkpoint_file)
+
+
+def reset_checkpoint(conn, checkpoint_file=None):
+    """ start next checkpointed load from the first record """
+    if checkpoint_file is None:
+        read_checkpoint(conn)
+        execute_checked(conn, "DELETE FROM {} WHERE name = '{}'".format(
+            CHECKPOINT_TABLE, TABLE))
+    elif os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+
+def load_from_checkpoint(conn, records, records_at_once, batches_per_commit,
+                         checkpoint_file=None):
+    """ insert records after checkpoint committing every few batches """
+    if not conn.is_connected() or not conn.status():
+        raise RuntimeError(conn.error_message())
+    parameters = rapidpg.Parameters()
+    start = read_checkpoint(conn, checkpoint_file)
+    if start > 0 and table_rows(conn) != start:
+        raise ValueError("checkpoint after {} records does not match {}, "
+                         "reset it to load from scratch".format(start, TABLE))
+    prepare_inserter(conn, records_at_once)
+    while start < records:
+        end = min(start + batches_per_commit*records_at_once, records)
+        execute_checked(conn, "BEGIN TRANSACTION")
+        add_records(conn, end, records_at_once, parameters, start)
+        insert_tail(conn, start, end, records_at_once, parameters)
+        save_checkpoint(conn, start, end, checkpoint_file)
+        if conn.transaction_status() != \
+                rapidpg.Connection.TransactionStatusType.PQTRANS_INTRANS:
+            message = conn.error_message()
+            conn.execute("ROLLBACK TRANSACTION")
+            raise RuntimeError(message)
+        execute_checked(conn, "COMMIT TRANSACTION")
+        if checkpoint_file is not None:
+            save_checkpoint(conn, end, end, checkpoint_file)
+        start = end
+    return start
+
+
+def checkpointed_load(conn_params, records, records_at_once,
+                      batches_per_commit=16, checkpoint_file=None, retries=3,
+                      instrumentation=None, backoff=1.0):
+    """ load records in short transactions, resuming after failures """
+    failures = 0
+    while True:
+        conn = rapidpg.Connection(conn_params,
+                                  instrumentation=instrumentation)
+        try:
+            return load_from_checkpoint(conn, records, records_at_once,
+                                        batches_per_commit, checkpoint_file)
+        except RuntimeError as error:
+            failures += 1
+            if failures > retries:
+                raise
+            print("  load failed, resuming from checkpoint:",
+                  str(error).strip())
+        finally:
+            conn.close()
+        time.sleep(backoff*2**(failures - 1))
+
+
+def parallel_load(conn_params, records, records_at_once, workers=None):
+    """ split records into ranges and load them by a pool of processes """
+    if workers is None:
+        workers = os.cpu_count()
+    bounds = [records*k // workers for k in range(workers + 1)]
+    now = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=set_hosts, initargs=(HOSTS,)) as pool:
+        loads = [pool.submit(load_range, conn_params, start, end,
+                             records_at_once)
+                 for start, end in zip(bounds, bounds[1:]) if start < end]
+        for load in concurrent.futures.as_completed(loads):
+            start, end, seconds = load.result()
+            print("  [{}, {}) --- {:.3} seconds, {:.0f} records/s".format(
+                start, end, seconds, (end - start) / seconds))
+    seconds = time.monotonic() - now
+    print(records, "records loaded by {} workers --- {:.3} seconds, "
+          "{:.0f} records/s".format(workers, seconds, records / seconds))
+
+
+def replay_records(conn, path, records_at_once, parameters):
+    """ insert records saved by write_blocks, returns their number """
+    records = 0
+    for columns in read_blocks(path, records_at_once):
+        rows = len(columns[0])
+        if conn.instrumentation is None:
+            parameters.add_columns(columns, COLUMN_TYPES)
+        else:
+            with conn.instrumentation.encoding():
+                parameters.add_columns(columns, COLUMN_TYPES)
+        if rows == records_at_once:
+            res = conn.exec_prepared("inserter", parameters)
+        else:
+            res = conn.query(insert_statement(rows), parameters)
+        assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+        records += rows
+    return records
+
+
+def copy_records(conn, records, records_at_once, parameters):
+    """ stream records through binary COPY FROM STDIN """
+    copy = conn.copy_in(
+        "COPY {} ({}) FROM STDIN (FORMAT binary)".format(TABLE, COLUMNS),
+        len(COLUMNS.split(",")))
+    assert copy.is_ready()
+    for i in range(0, records, records_at_once):
+        encode_columns(conn, parameters, i,
+                       min(i + records_at_once, records))
+        sent = copy.put_parameters(parameters)
+        assert sent
+    return copy.end()
+
+
+def pipeline_records(conn, records, records_at_once, parameters, depth=4):
+    """ insert records keeping up to `depth` batches in flight """
+    entered = conn.enter_pipeline()
+    assert entered
+    pending = 0
+    i = records_at_once
+    while i <= records:
+        encode_columns(conn, parameters, i - records_at_once, i)
+        sent = conn.send_prepared("inserter", parameters) and \
+            conn.send_flush_request()
+        assert sent
+        pending += 1
+        if pending == depth:
+            res = conn.get_query_result()
+            assert res.status() == \
+                rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+            pending -= 1
+        i += records_at_once
+    synced = conn.pipeline_sync()
+    assert synced
+    for _ in range(pending):
+        res = conn.get_query_result()
+        assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    res = conn.get_query_result()
+    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_PIPELINE_SYNC
+    exited = conn.exit_pipeline()
+    assert exited
+
+
+async def async_add_records(conn, records, records_at_once, parameters,
+                            depth=4):
+    """ insert records through AsyncConnection """
+    aconn = rapidpg.AsyncConnection(conn)
+    pending = collections.deque()
+    i = records_at_once
+    while i <= records:
+        encode_columns(conn, parameters, i - records_at_once, i)
+        pending.append(aconn.exec_prepared("inserter", parameters))
+        if len(pending) == depth:
+            res = await pending.popleft()
+            assert res.status() == \
+                rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+        i += records_at_once
+    while pending:
+        res = await pending.popleft()
+        assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    res = await aconn.sync()
+    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_PIPELINE_SYNC
+    aconn.close()
+
+
+def percentile(latencies, rank):
+    """ Linearly interpolated percentile of sorted latencies"""
+    position = (len(latencies) - 1)*rank/100
+    lower = int(position)
+    upper = min(lower + 1, len(latencies) - 1)
+    return latencies[lower] + \
+        (latencies[upper] - latencies[lower])*(position - lower)
+
+
+def benchmark_queries(conn, records, queries=None, warmup=2, trials=10):
+    """ Latency percentiles and scan rate of aggregate queries"""
+    if trials < 1:
+        raise ValueError("at least one trial is needed, got {}".format(
+            trials))
+    if queries is None:
+        queries = QUERIES
+    execute_checked(conn, "ANALYZE {}".format(TABLE))
+    rows = table_rows(conn)
+    results = []
+    for name, sql in queries.items():
+        sql = sql.format(TABLE)
+        for _ in range(warmup):
+            execute_checked(conn, sql)
+        latencies = []
+        for _ in range(trials):
+            now = time.perf_counter()
+            res = execute_checked(conn, sql)
+            latencies.append(time.perf_counter() - now)
+        latencies.sort()
+        result = {"query": name, "records": records, "table_rows": rows,
+                  "trials": trials, "result_rows": res.rowcount(),
+                  "mean_ms": sum(latencies) / trials * 1000}
+        for rank in PERCENTILES:
+            result["p{}_ms".format(rank)] = percentile(latencies, rank)*1000
+        result["rows_per_second"] = rows / percentile(latencies, 50)
+        print(json.dumps(result))
+        results.append(result)
+    return results
+
+
+def test_database(host, user, password, database, records, method="insert",
+                  instrumentation=None):
     """Fills in database table and executes aggregate query on it"""
     conn = rapidpg.Connection({"hostaddr": host, "user": user,
                                "password": password, "dbname": "postgres"})
@@ -80,79 +620,138 @@ def test_database(host, user, password, database, records):
         assert res.has_result()
         assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
     conn = rapidpg.Connection({"hostaddr": host, "user": user,
-                               "password": password, "dbname": database})
+                               "password": password, "dbname": database},
+                              instrumentation=instrumentation)
     assert conn.is_connected()
     assert conn.status()
     records_at_once = 65536 // 7
-    res = conn.execute((
-        """
-        CREATE EXTENSION IF NOT EXISTS pgcrypto;
-        DROP TABLE IF EXISTS {0};
-        CREATE TABLE IF NOT EXISTS {0}
-        (
-            --guid UUID NOT NULL DEFAULT gen_random_uuid(),
-            host_from bigint,
-            host_to bigint,
-            ip_from inet,
-            ip_to inet,
-            service bigint,
-            inbound double precision,
-            outbound double precision--,
-            --attrs jsonb--,
-            --CONSTRAINT pk_conversations PRIMARY KEY(guid),
-            --CONSTRAINT uq_converstions UNIQUE
-            --    (host_from, host_to, ip_from, ip_to, service),
-            --CONSTRAINT ck_inbound CHECK(inbound >= 0.0),
-            --CONSTRAINT ck_outbound CHECK(outbound >= 0.0)
-        );
-        ALTER TABLE {0} SET UNLOGGED;
-        --SET synchronous_commit TO OFF;
-        --SET commit_delay TO 100000;
-        DELETE FROM {0};
-        PREPARE inserter AS
-            INSERT INTO {0}
-            (host_from, host_to, ip_from, ip_to, service, inbound, outbound)
-            VALUES
-        """ + generate_insert_values(records_at_once, 7) + ";")
-        .format("large_conversations")
-        )
+    conn_params = {"hostaddr": host, "user": user, "password": password,
+                   "dbname": database}
+    if method == "checkpoint":
+        loaded = read_checkpoint(conn)
+        if 0 < loaded < records and table_rows(conn) == loaded:
+            print("  resuming after", loaded, "records")
+        else:
+            reset_checkpoint(conn)
+            loaded = 0
+    else:
+        # the table is recreated below, the checkpoint would not count it
+        reset_checkpoint(conn)
+    if method != "checkpoint" or loaded == 0:
+        res = conn.execute((
+            """
+            CREATE EXTENSION IF NOT EXISTS pgcrypto;
+            DROP TABLE IF EXISTS {0};
+            CREATE TABLE IF NOT EXISTS {0}
+            (
+                --guid UUID NOT NULL DEFAULT gen_random_uuid(),
+                host_from bigint,
+                host_to bigint,
+                ip_from inet,
+                ip_to inet,
+                service bigint,
+                inbound double precision,
+                outbound double precision--,
+                --attrs jsonb--,
+                --CONSTRAINT pk_conversations PRIMARY KEY(guid),
+                --CONSTRAINT uq_converstions UNIQUE
+                --    (host_from, host_to, ip_from, ip_to, service),
+                --CONSTRAINT ck_inbound CHECK(inbound >= 0.0),
+                --CONSTRAINT ck_outbound CHECK(outbound >= 0.0)
+            );
+            ALTER TABLE {0} SET UNLOGGED;
+            --SET synchronous_commit TO OFF;
+            --SET commit_delay TO 100000;
+            DELETE FROM {0};
+            """).format(TABLE)
+            )
+        assert res.has_result()
+        assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
 
-    assert res.has_result()
-    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    assert records <= IP_ADDRESSES*len(SERVICES)*len(TLDS)*len(TLDS)
+    if method == "parallel":
+        parallel_load(conn_params, records, records_at_once)
+        return
+    if method == "checkpoint":
+        now = time.monotonic()
+        loaded = checkpointed_load(conn_params, records, records_at_once,
+                                   instrumentation=instrumentation)
+        print(loaded, "records loaded with checkpoints --- {:.3} seconds"
+              .format(time.monotonic() - now))
+        return
 
+    if method == "replay":
+        # written once, outside of the timed load
+        path = os.path.join(tempfile.gettempdir(), "{}_{}_{}_{}.bin".format(
+            TABLE, records, records_at_once, SEED))
+        if not os.path.exists(path):
+            write_blocks(path, records, records_at_once)
     now = time.monotonic()
     res = conn.execute("BEGIN TRANSACTION")
 
     assert res.has_result()
     assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
 
-    assert records <= IP_ADDRESSES*len(SERVICES)*len(TLDS)*len(TLDS)
     parameters = rapidpg.Parameters()
-    add_records(conn, records, records_at_once, parameters)
-    records_at_once = records % records_at_once
-    if records_at_once > 0:
-        res = conn.execute((
-            """
-            DEALLOCATE inserter;
-            PREPARE inserter AS
-              INSERT INTO {0}
-              (host_from, host_to, ip_from, ip_to, service, inbound, outbound)
-              VALUES
-            """ + generate_insert_values(records_at_once, 7) + ";")
-            .format("large_conversations")
-            )
+    if method == "copy":
+        res = copy_records(conn, records, records_at_once, parameters)
         assert res.has_result()
         assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
-        fill_in_parameters(parameters, records - records_at_once, records)
-        res = conn.exec_prepared("inserter", parameters)
+        res = conn.execute("COMMIT TRANSACTION")
         assert res.has_result()
         assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
-    res = conn.execute("DEALLOCATE inserter; COMMIT TRANSACTION")
+        print(records, "records copied --- {:.3} seconds".format(
+            time.monotonic() - now))
+        return
+    prepare_inserter(conn, records_at_once)
+    loaded = 0
+    if method == "pipeline":
+        pipeline_records(conn, records, records_at_once, parameters)
+    elif method == "async":
+        asyncio.run(async_add_records(conn, records, records_at_once,
+                                      parameters))
+    elif method == "replay":
+        replayed = replay_records(conn, path, records_at_once, parameters)
+        assert replayed == records
+    else:
+        records_at_once, loaded = add_records(
+            conn, records, records_at_once, parameters,
+            autotune=method == "autotune")
+    if method != "replay":
+        insert_tail(conn, loaded, records, records_at_once, parameters)
+    res = conn.deallocate("inserter")
+    assert res.has_result()
+    assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
+    res = conn.execute("COMMIT TRANSACTION")
     assert res.has_result()
     assert res.status() == rapidpg.Result.ExecStatusType.PGRES_COMMAND_OK
-    print(records, "records inserted --- {:.3} seconds".format(
-        time.monotonic() - now))
+    print(records, "records inserted ({}) --- {:.3} seconds".format(
+        method, time.monotonic() - now))
+
+
+def main():
+    """ Load tables of growing size by every method, benchmark queries """
+    query_results = []
+    for rec in (100, 1000, 10**4, 10**5, 10**6, 10**7, 10**8):
+        for load_method in ("insert", "autotune", "copy", "pipeline", "async",
+                            "parallel", "replay", "checkpoint"):
+            stats = rapidpg.Instrumentation()
+            test_database("192.168.8.180", "test", "test", "large", rec,
+                          load_method, stats)
+            if load_method not in CLIENT_BOUND_METHODS:
+                continue
+            snapshot = stats.snapshot()
+            print("  encoding {:.3} seconds, server {:.3} seconds, {:.0%} "
+                  "client bound".format(snapshot["encode_seconds"],
+                                        snapshot["server_seconds"],
+                                        snapshot["encode_share"]))
+        query_results += benchmark_queries(rapidpg.Connection(
+            {"hostaddr": "192.168.8.180", "user": "test", "password": "test",
+             "dbname": "large"}), rec)
+    with open("large_postgres_queries.json", "w", encoding="utf-8") as report:
+        json.dump(query_results, report, indent=1)
+    return query_results
 
 
-for rec in (100, 1000, 10**4, 10**5, 10**6, 10**7, 10**8):
-    test_database("192.168.8.180", "test", "test", "large", rec)
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,113 @@
 """ rapidpg module """
 
+import array
+import bisect
+import collections
+import contextlib
 import ctypes
+import itertools
+import os
+import re
+import struct
+import sys
+import threading
+import time
 from enum import IntEnum
 
 
+class Library:
+    """ shared library loaded and bound on first use """
+
+    # os.pathsep separated directories searched before the default ones
+    SEARCH_PATH = 'RAPIDPG_LIBRARY_PATH'
+
+    def __init__(self, names, environment, short_name):
+        # file names, variable overriding the path and name for find_library
+        self.names = names
+        self.environment = environment
+        self.short_name = short_name
+        self.dll = None
+        self.path = None
+        # name: (restype, argtypes) of functions, ctypes type of variables
+        self.functions = {}
+        self.variables = {}
+
+    def declare(self, name, restype, argtypes):
+        """ declare function signature, bound on first use """
+        self.functions[name] = (restype, argtypes)
+
+    def declare_variable(self, name, ctype):
+        """ declare variable, bound on first use as pointer to it """
+        self.variables[name] = ctype
+
+    def candidates(self):
+        """ paths to load library from in order of preference """
+        override = os.environ.get(self.environment)
+        if override:
+            return [override]
+        directories = [directory for directory in os.environ.get(
+            Library.SEARCH_PATH, '').split(os.pathsep) if directory]
+        directories += [os.path.dirname(os.path.abspath(__file__)),
+                        os.getcwd()]
+        paths = [os.path.join(directory, name) for directory in directories
+                 for name in self.names]
+        paths = [path for path in paths if os.path.exists(path)]
+        # left to the dynamic loader and its cache
+        paths += list(self.names)
+        return paths
+
+    def load(self):
+        """ load library if not yet loaded """
+        if self.dll is not None:
+            return self.dll
+        errors = []
+        for path in self.candidates():
+            try:
+                self.dll = ctypes.CDLL(path)
+            except OSError as error:
+                errors.append(str(error))
+                continue
+            self.path = path
+            return self.dll
+        if not os.environ.get(self.environment):
+            from ctypes import util  # pylint: disable=import-outside-toplevel
+            path = util.find_library(self.short_name)
+            if path is not None:
+                self.dll = ctypes.CDLL(path)
+                self.path = path
+                return self.dll
+        raise OSError("cannot load {}, set {} to its path: {}".format(
+            self.names[0], self.environment, '; '.join(errors)))
+
+    def available(self, name):
+        """ whether loaded library has the symbol """
+        return hasattr(self.load(), name)
+
+    def bind_all(self):
+        """ bind every declared symbol the library has, returns their count """
+        count = 0
+        for name in itertools.chain(self.functions, self.variables):
+            if self.available(name):
+                getattr(self, name)
+                count += 1
+        return count
+
+    def __getattr__(self, name):
+        # only called for symbols not bound yet, bound ones are attributes
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self.functions:
+            value = getattr(self.load(), name)
+            value.restype, value.argtypes = self.functions[name]
+        elif name in self.variables:
+            value = ctypes.pointer(self.variables[name].in_dll(self.load(),
+                                                               name))
+        else:
+            raise AttributeError("{} is not declared".format(name))
+        setattr(self, name, value)
+        return value
+
+
 class Parameters:
     """ pg parameters encapsulation """
 
@@ -18,52 +122,103 @@ class Parameters:
                     ('length', ctypes.c_size_t)
                     ]
 
-    librapidpg = ctypes.CDLL('./librapidpg.so')
+    class ColumnType(IntEnum):
+        """ column type tags for add_columns """
+        INT8 = 0
+        FLOAT8 = 1
+        IP4_HBO = 2
+
+    # every column value is encoded as 8 bytes in network byte order
+    COLUMN_FORMATS = {ColumnType.INT8: 'q',
+                      ColumnType.FLOAT8: 'd',
+                      ColumnType.IP4_HBO: 'Q'}
+    COLUMN_VALUE_LENGTH = 8
 
-    librapidpg.rapidpg_create_parameters.restype = ctypes.POINTER(
-        Wrapper)
-    librapidpg.rapidpg_create_parameters.argtypes = []
+    # inet binary header: family, bits, is_cidr, address length
+    IP4_HEADER = (2 << 56) | (32 << 48) | (0 << 40) | (4 << 32)
 
-    librapidpg.rapidpg_set_current.restype = ctypes.c_int
-    librapidpg.rapidpg_set_current.argtypes = [ctypes.POINTER(Wrapper),
-                                               ctypes.c_size_t]
+    librapidpg = Library(('librapidpg.so',), 'RAPIDPG_LIBRARY', 'rapidpg')
 
-    librapidpg.rapidpg_add_int.restype = ctypes.c_int
-    librapidpg.rapidpg_add_int.argtypes = [ctypes.POINTER(Wrapper),
-                                           ctypes.c_longlong]
+    librapidpg.declare('rapidpg_create_parameters', ctypes.POINTER(Wrapper),
+                       [])
 
-    librapidpg.rapidpg_add_double.restype = ctypes.c_int
-    librapidpg.rapidpg_add_double.argtypes = [ctypes.POINTER(Wrapper),
-                                              ctypes.c_double]
+    librapidpg.declare('rapidpg_set_current', ctypes.c_int, [
+        ctypes.POINTER(Wrapper), ctypes.c_size_t])
 
-    librapidpg.rapidpg_add_ip4_hbo.restype = ctypes.c_int
-    librapidpg.rapidpg_add_ip4_hbo.argtypes = [ctypes.POINTER(Wrapper),
-                                               ctypes.c_uint]
+    librapidpg.declare('rapidpg_add_int', ctypes.c_int, [
+        ctypes.POINTER(Wrapper), ctypes.c_longlong])
 
-    librapidpg.rapidpg_destroy_parameters.restype = None
-    librapidpg.rapidpg_destroy_parameters.argtypes = [ctypes.POINTER(Wrapper)]
+    librapidpg.declare('rapidpg_add_double', ctypes.c_int, [
+        ctypes.POINTER(Wrapper), ctypes.c_double])
+
+    librapidpg.declare('rapidpg_add_ip4_hbo', ctypes.c_int, [
+        ctypes.POINTER(Wrapper), ctypes.c_uint])
+
+    librapidpg.declare('rapidpg_destroy_parameters', None, [
+        ctypes.POINTER(Wrapper)])
 
     def __init__(self):
-        self.parameters = Parameters.librapidpg.rapidpg_create_parameters()
+        self.native = None
+        self.native = Parameters.librapidpg.rapidpg_create_parameters()
+        self.parameters = self.native
+        self.columns = None
 
     def __del__(self):
-        Parameters.librapidpg.rapidpg_destroy_parameters(self.parameters)
+        if self.native is not None:
+            Parameters.librapidpg.rapidpg_destroy_parameters(self.native)
 
     def set_current(self, current):
         """ set current parameter """
-        Parameters.librapidpg.rapidpg_set_current(self.parameters, current)
+        self.parameters = self.native
+        self.columns = None
+        Parameters.librapidpg.rapidpg_set_current(self.native, current)
 
     def add_int(self, value):
         """ add int """
-        Parameters.librapidpg.rapidpg_add_int(self.parameters, value)
+        Parameters.librapidpg.rapidpg_add_int(self.native, value)
 
     def add_double(self, value):
         """ add double """
-        Parameters.librapidpg.rapidpg_add_double(self.parameters, value)
+        Parameters.librapidpg.rapidpg_add_double(self.native, value)
 
     def add_ip4_hbo(self, value):
         """ add IPv4 address """
-        Parameters.librapidpg.rapidpg_add_ip4_hbo(self.parameters, value)
+        Parameters.librapidpg.rapidpg_add_ip4_hbo(self.native, value)
+
+    @staticmethod
+    def column_values(column, column_type):
+        """ convert column to a sequence of values to be packed """
+        if not isinstance(column, (list, tuple, range, array.array)):
+            column = memoryview(column).tolist()
+        if column_type == Parameters.ColumnType.IP4_HBO:
+            header = Parameters.IP4_HEADER
+            column = [header | value for value in column]
+        return column
+
+    def add_columns(self, columns, types):
+        """ replace parameters with rows made of whole columns """
+        columns = [Parameters.column_values(column, column_type)
+                   for column, column_type in zip(columns, types)]
+        rows = len(columns[0]) if columns else 0
+        assert all(len(column) == rows for column in columns)
+        count = rows*len(columns)
+        size = Parameters.COLUMN_VALUE_LENGTH
+        values = ctypes.create_string_buffer(size*count)
+        struct.pack_into(
+            '>' + ''.join(Parameters.COLUMN_FORMATS[column_type]
+                          for column_type in types)*rows,
+            values, 0, *itertools.chain.from_iterable(zip(*columns)))
+        pointers = (ctypes.c_char_p * count)()
+        base = ctypes.addressof(values)
+        ctypes.cast(pointers, ctypes.POINTER(ctypes.c_void_p * count)
+                    ).contents[:] = range(base, base + size*count, size)
+        lengths = (ctypes.c_int * count)()
+        lengths[:] = [size]*count
+        wrapper = Parameters.Wrapper(
+            lengths, pointers, ctypes.cast(values, ctypes.c_char_p),
+            count, count, size*count, size*count)
+        self.columns = (values, pointers, lengths, wrapper)
+        self.parameters = ctypes.pointer(wrapper)
 
 
 class CtypesEnum(IntEnum):
@@ -103,20 +258,49 @@ class Result:
         PGRES_FATAL_ERROR = 7       # query failed
         PGRES_COPY_BOTH = 8         # Copy In/Out data transfer in progress
         PGRES_SINGLE_TUPLE = 9      # single tuple from larger resultset
+        PGRES_PIPELINE_SYNC = 10    # pipeline synchronization point
+        PGRES_PIPELINE_ABORTED = 11  # Command didn't run because of an abort
+                                     # earlier in a pipeline
+        PGRES_TUPLES_CHUNK = 12     # chunk of tuples from larger resultset
 
-    libpq = ctypes.CDLL('libpq.so')
+    libpq = Library(('libpq.so', 'libpq.so.5'), 'RAPIDPG_LIBPQ', 'pq')
 
-    libpq.PQresultStatus.restype = ExecStatusType
-    libpq.PQresultStatus.argtypes = [ctypes.c_void_p]
+    libpq.declare('PQresultStatus', ExecStatusType, [ctypes.c_void_p])
 
-    libpq.PQntuples.restype = ctypes.c_int
-    libpq.PQntuples.argtypes = [ctypes.c_void_p]
+    libpq.declare('PQntuples', ctypes.c_int, [ctypes.c_void_p])
 
-    libpq.PQclear.restype = None
-    libpq.PQclear.argtypes = [ctypes.c_void_p]
+    libpq.declare('PQclear', None, [ctypes.c_void_p])
 
-    libpq.PQresultErrorMessage.restype = ctypes.c_char_p
-    libpq.PQresultErrorMessage.argtypes = [ctypes.c_void_p]
+    libpq.declare('PQresultErrorMessage', ctypes.c_char_p, [ctypes.c_void_p])
+
+    libpq.declare('PQnfields', ctypes.c_int, [ctypes.c_void_p])
+
+    libpq.declare('PQfnumber', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_char_p])
+
+    libpq.declare('PQftype', ctypes.c_uint, [ctypes.c_void_p, ctypes.c_int])
+
+    libpq.declare('PQfformat', ctypes.c_int, [ctypes.c_void_p, ctypes.c_int])
+
+    libpq.declare('PQgetvalue', ctypes.c_void_p, [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int])
+
+    libpq.declare('PQgetlength', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int])
+
+    libpq.declare('PQcmdTuples', ctypes.c_char_p, [ctypes.c_void_p])
+
+    libpq.declare('PQgetisnull', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int])
+
+    INET_OID = 869
+    # type oid: (array typecode, numpy dtype) of binary column values
+    COLUMN_TYPES = {20: ('q', '>i8'),      # int8
+                    23: ('i', '>i4'),      # int4
+                    21: ('h', '>i2'),      # int2
+                    701: ('d', '>f8'),     # float8
+                    700: ('f', '>f4'),     # float4
+                    INET_OID: ('I', '>u4')}
 
     def __init__(self, result, sql):
         self.pg_result = result
@@ -143,12 +327,201 @@ class Result:
         return Result.libpq.PQresultErrorMessage(
             self.pg_result).decode('utf-8')
 
+    def affected_rows(self):
+        """ rows affected by the command, 0 if it does not report them """
+        return int(Result.libpq.PQcmdTuples(self.pg_result) or 0)
+
+    def column_count(self):
+        """ number of columns """
+        return Result.libpq.PQnfields(self.pg_result)
+
+    def column_index(self, name):
+        """ column number by name, -1 if there is no such column """
+        return Result.libpq.PQfnumber(self.pg_result, name.encode('utf-8'))
+
+    def value(self, row, column):
+        """ text value of a cell, None for NULL """
+        if Result.libpq.PQgetisnull(self.pg_result, row, column):
+            return None
+        return ctypes.string_at(
+            Result.libpq.PQgetvalue(self.pg_result, row, column),
+            Result.libpq.PQgetlength(self.pg_result, row, column)
+            ).decode('utf-8')
+
+    def rows(self):
+        """ iterate over rows of text values """
+        columns = range(self.column_count())
+        for row in range(self.rowcount()):
+            yield tuple(self.value(row, column) for column in columns)
+
+    def column_bytes(self, index, length):
+        """ binary values of a column packed into one buffer """
+        # libpq has no call returning a whole column, so every cell costs
+        # PQgetlength, PQgetvalue and a memmove; only the decoding of the
+        # packed buffer by column() is done in one pass
+        rows = self.rowcount()
+        pg_result = self.pg_result
+        getvalue = Result.libpq.PQgetvalue
+        getlength = Result.libpq.PQgetlength
+        memmove = ctypes.memmove
+        values = ctypes.create_string_buffer(rows*length)
+        base = ctypes.addressof(values)
+        for row in range(rows):
+            if getlength(pg_result, row, index) != length:
+                raise ValueError("row {} of column {} is NULL or not {} bytes"
+                                 " long".format(row, index, length))
+            memmove(base + row*length, getvalue(pg_result, row, index),
+                    length)
+        return values
+
+    def column(self, column, as_numpy=False):
+        """ decode binary int, float or IPv4 inet column into an array """
+        index = column if isinstance(column, int) else \
+            self.column_index(column)
+        if not 0 <= index < self.column_count():
+            raise IndexError("no column {}".format(column))
+        if Result.libpq.PQfformat(self.pg_result, index) != 1:
+            raise ValueError("column {} is not in binary format".format(
+                column))
+        oid = Result.libpq.PQftype(self.pg_result, index)
+        if oid not in Result.COLUMN_TYPES:
+            raise TypeError("column {} has unsupported type {}".format(
+                column, oid))
+        typecode, dtype = Result.COLUMN_TYPES[oid]
+        if oid == Result.INET_OID:
+            # family, bits, is_cidr, address length, address
+            values = self.column_bytes(index, 8)
+        else:
+            values = self.column_bytes(index, struct.calcsize(typecode))
+        if as_numpy:
+            # imported on use to keep import time low
+            import numpy  # pylint: disable=import-outside-toplevel
+            result = numpy.frombuffer(values, dtype).astype(dtype[1:])
+            return result[1::2].copy() if oid == Result.INET_OID else result
+        result = array.array(typecode)
+        result.frombytes(values)
+        if sys.byteorder == 'little':
+            result.byteswap()
+        return result[1::2] if oid == Result.INET_OID else result
+
+
+class Instrumentation:
+    """ opt-in latency, bytes and rows statistics of connections """
+
+    # upper bounds of latency histogram buckets in seconds
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    # calls queueing data in client buffers rather than waiting for server
+    BUFFERED = frozenset(('send_prepared', 'put_copy_data'))
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.encode_count = 0
+        self.encode_seconds = 0.0
+
+    def observe(self, operation, seconds, bytes_sent=0, rows_affected=0):
+        """ record one call to the server """
+        with self.lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = {
+                    'count': 0, 'seconds': 0.0, 'bytes_sent': 0,
+                    'rows_affected': 0,
+                    'buckets': [0]*(len(self.buckets) + 1)}
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['bytes_sent'] += bytes_sent
+            stats['rows_affected'] += rows_affected
+            stats['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def observe_encoding(self, seconds):
+        """ record time spent filling in Parameters """
+        with self.lock:
+            self.encode_count += 1
+            self.encode_seconds += seconds
+
+    @contextlib.contextmanager
+    def encoding(self):
+        """ time the block as Parameters encoding """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_encoding(time.perf_counter() - started)
+
+    def reset(self):
+        """ forget everything recorded so far """
+        with self.lock:
+            self.operations = {}
+            self.encode_count = 0
+            self.encode_seconds = 0.0
+
+    def snapshot(self):
+        """ copy of statistics as a dict, histogram buckets are cumulative """
+        with self.lock:
+            operations = {}
+            for operation, stats in self.operations.items():
+                bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+                operations[operation] = dict(
+                    stats, buckets=dict(zip(bounds, itertools.accumulate(
+                        stats['buckets']))))
+            server_seconds = buffered_seconds = 0.0
+            for operation, stats in self.operations.items():
+                if operation in Instrumentation.BUFFERED:
+                    buffered_seconds += stats['seconds']
+                else:
+                    server_seconds += stats['seconds']
+            total = server_seconds + self.encode_seconds
+            return {'operations': operations,
+                    'encode_count': self.encode_count,
+                    'encode_seconds': self.encode_seconds,
+                    'server_seconds': server_seconds,
+                    'buffered_seconds': buffered_seconds,
+                    'encode_share': self.encode_seconds / total
+                                    if total else 0.0}
+
+    def prometheus(self, prefix='rapidpg'):
+        """ snapshot in Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines = ['# HELP {}_call_seconds Latency of calls to the server'
+                 .format(prefix),
+                 '# TYPE {}_call_seconds histogram'.format(prefix)]
+        for operation, stats in sorted(snapshot['operations'].items()):
+            for bound, count in stats['buckets'].items():
+                lines.append('{}_call_seconds_bucket{{operation="{}",le="{}"}}'
+                             ' {}'.format(prefix, operation, bound, count))
+            lines.append('{}_call_seconds_sum{{operation="{}"}} {!r}'.format(
+                prefix, operation, stats['seconds']))
+            lines.append('{}_call_seconds_count{{operation="{}"}} {}'.format(
+                prefix, operation, stats['count']))
+        for name, key, text in (
+                ('bytes_sent_total', 'bytes_sent',
+                 'Statement and parameter bytes sent'),
+                ('rows_affected_total', 'rows_affected', 'Rows affected')):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, text))
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            for operation, stats in sorted(snapshot['operations'].items()):
+                lines.append('{}_{}{{operation="{}"}} {}'.format(
+                    prefix, name, operation, stats[key]))
+        lines += ['# HELP {}_encode_seconds_total Time spent encoding '
+                  'parameters'.format(prefix),
+                  '# TYPE {}_encode_seconds_total counter'.format(prefix),
+                  '{}_encode_seconds_total {!r}'.format(
+                      prefix, snapshot['encode_seconds']),
+                  '# HELP {}_encodes_total Parameters encoded'.format(prefix),
+                  '# TYPE {}_encodes_total counter'.format(prefix),
+                  '{}_encodes_total {}'.format(prefix,
+                                               snapshot['encode_count'])]
+        return '\n'.join(lines) + '\n'
+
 
 class Connection:
     """ Wrapper of PGconn* """
 
-    RAPID_PG_BINARY = ctypes.pointer(ctypes.c_int.in_dll(
-        Parameters.librapidpg, 'RAPID_PG_BINARY'))
+    # paramFormats array of all binary parameters
+    Parameters.librapidpg.declare_variable('RAPID_PG_BINARY', ctypes.c_int)
 
     class ConnStatusType(CtypesEnum):
         """ enum ConnStatusType """
@@ -184,32 +557,105 @@ class Connection:
         # consume them.
         CONNECTION_CONSUME = 10
 
-    Result.libpq.PQstatus.restype = ConnStatusType
-    Result.libpq.PQstatus.argtypes = [ctypes.c_void_p]
+    class TransactionStatusType(CtypesEnum):
+        """ enum PGTransactionStatusType """
+        PQTRANS_IDLE = 0                    # connection idle
+        PQTRANS_ACTIVE = 1                  # command in progress
+        PQTRANS_INTRANS = 2                 # idle, within transaction block
+        PQTRANS_INERROR = 3                 # idle, within failed transaction
+        PQTRANS_UNKNOWN = 4                 # cannot determine status
+
+    Result.libpq.declare('PQstatus', ConnStatusType, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQtransactionStatus', TransactionStatusType, [
+        ctypes.c_void_p])
+
+    Result.libpq.declare('PQprepare', ctypes.c_void_p, [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_uint)])
+
+    Result.libpq.declare('PQerrorMessage', ctypes.c_char_p, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQfinish', None, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQexecPrepared', ctypes.c_void_p, [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_int), ctypes.c_int])
+
+    Result.libpq.declare('PQexec', ctypes.c_void_p, [
+        ctypes.c_void_p, ctypes.c_char_p])
+
+    Result.libpq.declare('PQexecParams', ctypes.c_void_p, [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_char_p),
+        ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+        ctypes.c_int])
+
+    Result.libpq.declare('PQconnectdbParams', ctypes.c_void_p, [
+        ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_char_p),
+        ctypes.c_int])
+
+    Result.libpq.declare('PQgetResult', ctypes.c_void_p, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQputCopyData', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int])
+
+    Result.libpq.declare('PQputCopyEnd', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_char_p])
+
+    Result.libpq.declare('PQsendQueryPrepared', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_int), ctypes.c_int])
+
+    Result.libpq.declare('PQconsumeInput', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQisBusy', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQflush', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQsocket', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQenterPipelineMode', ctypes.c_int, [
+        ctypes.c_void_p])
+
+    Result.libpq.declare('PQexitPipelineMode', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQpipelineSync', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQsendFlushRequest', ctypes.c_int, [ctypes.c_void_p])
+
+    Result.libpq.declare('PQsendQuery', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_char_p])
 
-    Result.libpq.PQerrorMessage.restype = ctypes.c_char_p
-    Result.libpq.PQerrorMessage.argtypes = [ctypes.c_void_p]
+    Result.libpq.declare('PQsetSingleRowMode', ctypes.c_int, [ctypes.c_void_p])
 
-    Result.libpq.PQfinish.restype = None
-    Result.libpq.PQfinish.argtypes = [ctypes.c_void_p]
+    # chunked rows mode is available since libpq 17
+    Result.libpq.declare('PQsetChunkedRowsMode', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_int])
 
-    Result.libpq.PQexecPrepared.restype = ctypes.c_void_p
-    Result.libpq.PQexecPrepared.argtypes = [
-        ctypes.c_void_p, ctypes.c_char_p,
-        ctypes.c_int, ctypes.POINTER(ctypes.c_char_p),
-        ctypes.POINTER(ctypes.c_int),
-        ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+    Result.libpq.declare('PQgetCancel', ctypes.c_void_p, [ctypes.c_void_p])
 
-    Result.libpq.PQexec.restype = ctypes.c_void_p
-    Result.libpq.PQexec.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    Result.libpq.declare('PQcancel', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int])
 
-    Result.libpq.PQconnectdbParams.restype = ctypes.c_void_p
-    Result.libpq.PQconnectdbParams.argtypes = [
-        ctypes.POINTER(ctypes.c_char_p),
-        ctypes.POINTER(ctypes.c_char_p),
-        ctypes.c_int]
+    Result.libpq.declare('PQfreeCancel', None, [ctypes.c_void_p])
 
-    def __init__(self, conn_params):
+    Result.libpq.declare('PQsetnonblocking', ctypes.c_int, [
+        ctypes.c_void_p, ctypes.c_int])
+
+    # normalize_sql keeps literals, identifiers and comments as is,
+    # a line comment with the newline ending it
+    TOKENS = re.compile(r"""
+        (?P<dollar>(?<![\w$])\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)
+        | (?P<escape>(?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*')
+        | (?P<quoted>'(?:[^']|'')*' | "(?:[^"]|"")*")
+        | (?P<comment>--[^\n]*\n? | /\*.*?\*/)
+        | (?P<spaces>\s+)""", re.VERBOSE | re.DOTALL)
+
+    def __init__(self, conn_params, statement_cache_size=256,
+                 instrumentation=None):
         keys = (ctypes.c_char_p * (len(conn_params)+1))()
         values = (ctypes.c_char_p * (len(conn_params)+1))()
         keys[:] = [key.encode('utf-8') for key in list(conn_params)
@@ -217,10 +663,62 @@ class Connection:
         values[:] = [key.encode('utf-8') for key in list(conn_params.values())
                      ] + [ctypes.c_char_p()]
         self.pg_conn = Result.libpq.PQconnectdbParams(keys, values, 0)
+        self.pid = os.getpid()
+        # prepared statement name: sql
+        self.prepared = {}
+        # normalized sql: statement name, least recently used first
+        self.statements = collections.OrderedDict()
+        self.statement_cache_size = statement_cache_size
+        self.statement_counter = itertools.count()
+        self.instrumentation = instrumentation
 
     def __del__(self):
-        if self.pg_conn is not None:
+        self.close()
+
+    def close(self):
+        """ close connection """
+        # socket inherited from the parent process belongs to the parent
+        if self.pg_conn is not None and self.pid == os.getpid():
             Result.libpq.PQfinish(self.pg_conn)
+        self.pg_conn = None
+        self.prepared = {}
+        self.statements = collections.OrderedDict()
+
+    def transaction_status(self):
+        """ transaction status of the connection """
+        return Result.libpq.PQtransactionStatus(self.pg_conn)
+
+    def prepare(self, statement, sql):
+        """ prepare statement and remember it """
+        result = Result(Result.libpq.PQprepare(
+            self.pg_conn, statement.encode('utf-8'), sql.encode('utf-8'),
+            0, None), sql)
+        if result.has_result() and result.status() == \
+                Result.ExecStatusType.PGRES_COMMAND_OK:
+            self.prepared[statement] = sql
+        return result
+
+    def is_prepared(self, statement):
+        """ whether statement was prepared by this connection """
+        return statement in self.prepared
+
+    def deallocate(self, statement):
+        """ deallocate prepared statement """
+        self.prepared.pop(statement, None)
+        return self.execute('DEALLOCATE "{}"'.format(
+            statement.replace('"', '""')))
+
+    def forget_deallocated(self):
+        """ drop remembered statements the server no longer has """
+        result = self.execute("SELECT name FROM pg_prepared_statements")
+        names = set()
+        if result.status() == Result.ExecStatusType.PGRES_TUPLES_OK:
+            names = {name for name, in result.rows()}
+        self.prepared = {statement: sql for statement, sql
+                         in self.prepared.items() if statement in names}
+        self.statements = collections.OrderedDict(
+            (key, statement) for key, statement in self.statements.items()
+            if statement in names)
 
     def is_connected(self):
         """ Whether connection is established """
@@ -235,19 +733,515 @@ class Connection:
         """ Get connection error message """
         return Result.libpq.PQerrorMessage(self.pg_conn).decode('utf-8')
 
+    def observe(self, operation, started, result=None, bytes_sent=0):
+        """ record call started at time.perf_counter() if instrumented """
+        if self.instrumentation is not None:
+            self.instrumentation.observe(
+                operation, time.perf_counter() - started, bytes_sent,
+                0 if result is None or not result.has_result()
+                else result.affected_rows())
+
     def execute(self, sql):
         """ execute sql w/o parameters """
-        return Result(Result.libpq.PQexec(self.pg_conn, sql.encode('utf-8')),
-                      sql)
+        started = time.perf_counter()
+        encoded = sql.encode('utf-8')
+        result = Result(Result.libpq.PQexec(self.pg_conn, encoded), sql)
+        self.observe('execute', started, result, len(encoded))
+        return result
+
+    def execute_binary(self, sql):
+        """ execute single sql statement, get result in binary format """
+        started = time.perf_counter()
+        encoded = sql.encode('utf-8')
+        result = Result(Result.libpq.PQexecParams(
+            self.pg_conn, encoded, 0, None, None, None, None, 1), sql)
+        self.observe('execute_binary', started, result, len(encoded))
+        return result
 
     def exec_prepared(self, statement, parameters):
         """ execute prepared statement """
+        started = time.perf_counter()
+        if parameters is None:
+            result = Result(Result.libpq.PQexecPrepared(
+                self.pg_conn, statement.encode('utf-8'), 0, None, None, None,
+                1), statement)
+            self.observe('exec_prepared', started, result)
+            return result
         contents = parameters.parameters.contents
-        return Result(Result.libpq.PQexecPrepared(
+        result = Result(Result.libpq.PQexecPrepared(
             self.pg_conn,
             statement.encode('utf-8'),
             contents.current,
             contents.pointers,
             contents.lengths,
-            Connection.RAPID_PG_BINARY,
+            Parameters.librapidpg.RAPID_PG_BINARY,
             1), statement)
+        self.observe('exec_prepared', started, result, contents.length)
+        return result
+
+    @staticmethod
+    def normalize_sql(sql):
+        """ statement cache key: sql with whitespace collapsed """
+        return Connection.TOKENS.sub(
+            lambda match: match.group() if match.group('spaces') is None
+            else " ", sql).strip().rstrip(";").rstrip()
+
+    def query(self, sql, parameters=None):
+        """ execute sql, preparing it on first use """
+        key = Connection.normalize_sql(sql)
+        statement = self.statements.get(key)
+        if statement is not None and statement in self.prepared:
+            self.statements.move_to_end(key)
+        else:
+            statement = "rapidpg_{}".format(next(self.statement_counter))
+            result = self.prepare(statement, sql)
+            if not self.is_prepared(statement):
+                return result
+            self.statements[key] = statement
+            while len(self.statements) > self.statement_cache_size:
+                _, evicted = self.statements.popitem(last=False)
+                self.deallocate(evicted)
+        return self.exec_prepared(statement, parameters)
+
+    def get_result(self):
+        """ get next result of the command in progress """
+        return Result(Result.libpq.PQgetResult(self.pg_conn), None)
+
+    def get_query_result(self):
+        """ get result of the next pipelined query, skip its terminator """
+        started = time.perf_counter()
+        result = self.get_result()
+        if result.has_result() and result.status() != \
+                Result.ExecStatusType.PGRES_PIPELINE_SYNC:
+            while self.get_result().has_result():
+                pass
+        self.observe('get_query_result', started, result)
+        return result
+
+    def cancel(self):
+        """ ask server to abandon the command in progress """
+        cancel = Result.libpq.PQgetCancel(self.pg_conn)
+        if cancel is None:
+            return False
+        error = ctypes.create_string_buffer(256)
+        cancelled = Result.libpq.PQcancel(cancel, error, len(error)) == 1
+        Result.libpq.PQfreeCancel(cancel)
+        return cancelled
+
+    def stream(self, sql, chunk_size=None):
+        """ yield result rows one by one or in lists of chunk_size rows """
+        if Result.libpq.PQsendQuery(self.pg_conn, sql.encode('utf-8')) != 1:
+            raise RuntimeError(self.error_message())
+        chunked = chunk_size is not None and Result.libpq.available(
+            'PQsetChunkedRowsMode')
+        if chunked:
+            mode = Result.libpq.PQsetChunkedRowsMode(self.pg_conn, chunk_size)
+        else:
+            mode = Result.libpq.PQsetSingleRowMode(self.pg_conn)
+        finished = False
+        try:
+            if mode != 1:
+                raise RuntimeError("can't switch to row by row mode")
+            block = []
+            while True:
+                result = self.get_result()
+                if not result.has_result():
+                    break
+                status = result.status()
+                if status == Result.ExecStatusType.PGRES_TUPLES_OK:
+                    continue
+                if status not in (Result.ExecStatusType.PGRES_SINGLE_TUPLE,
+                                  Result.ExecStatusType.PGRES_TUPLES_CHUNK):
+                    raise RuntimeError(result.error_message())
+                if chunk_size is None:
+                    yield from result.rows()
+                elif chunked:
+                    yield list(result.rows())
+                else:
+                    block.extend(result.rows())
+                    if len(block) >= chunk_size:
+                        yield block
+                        block = []
+            finished = True
+            if block:
+                yield block
+        finally:
+            if not finished:
+                self.cancel()
+                while self.get_result().has_result():
+                    pass
+
+    def send_prepared(self, statement, parameters):
+        """ send prepared statement w/o waiting for its result """
+        started = time.perf_counter()
+        contents = parameters.parameters.contents
+        sent = Result.libpq.PQsendQueryPrepared(
+            self.pg_conn,
+            statement.encode('utf-8'),
+            contents.current,
+            contents.pointers,
+            contents.lengths,
+            Parameters.librapidpg.RAPID_PG_BINARY,
+            1) == 1
+        self.observe('send_prepared', started, bytes_sent=contents.length)
+        return sent
+
+    def set_nonblocking(self, nonblocking):
+        """ switch connection to (non)blocking mode """
+        return Result.libpq.PQsetnonblocking(self.pg_conn,
+                                             int(nonblocking)) == 0
+
+    def flush(self):
+        """ send queued output: 0 - done, 1 - not yet, -1 - failed """
+        return Result.libpq.PQflush(self.pg_conn)
+
+    def consume_input(self):
+        """ read available input from server """
+        return Result.libpq.PQconsumeInput(self.pg_conn) == 1
+
+    def is_busy(self):
+        """ whether get_result() would block """
+        return Result.libpq.PQisBusy(self.pg_conn) == 1
+
+    def socket(self):
+        """ connection socket descriptor """
+        return Result.libpq.PQsocket(self.pg_conn)
+
+    def enter_pipeline(self):
+        """ enter pipeline mode """
+        return Result.libpq.PQenterPipelineMode(self.pg_conn) == 1
+
+    def exit_pipeline(self):
+        """ exit pipeline mode, all results should be already read """
+        return Result.libpq.PQexitPipelineMode(self.pg_conn) == 1
+
+    def pipeline_sync(self):
+        """ mark pipeline synchronization point """
+        return Result.libpq.PQpipelineSync(self.pg_conn) == 1
+
+    def send_flush_request(self):
+        """ ask server to send results of pipelined queries sent so far """
+        return Result.libpq.PQsendFlushRequest(self.pg_conn) == 1
+
+    def copy_in(self, sql, columns):
+        """ start COPY ... FROM STDIN (FORMAT binary) """
+        return CopyIn(self, self.execute(sql), columns)
+
+
+class AsyncConnection:
+    """ asyncio driven pipelined Connection """
+
+    def __init__(self, connection, loop=None):
+        self.connection = connection
+        if loop is None:
+            import asyncio  # pylint: disable=import-outside-toplevel
+            loop = asyncio.get_running_loop()
+        self.loop = loop
+        self.waiters = collections.deque()
+        self.result = None
+        if not (connection.set_nonblocking(True)
+                and connection.enter_pipeline()):
+            raise RuntimeError(connection.error_message())
+        self.socket = connection.socket()
+        self.writing = False
+        self.loop.add_reader(self.socket, self.on_readable)
+
+    def close(self):
+        """ stop watching the socket, leave pipeline mode """
+        self.loop.remove_reader(self.socket)
+        if self.writing:
+            self.loop.remove_writer(self.socket)
+            self.writing = False
+        self.connection.exit_pipeline()
+        self.connection.set_nonblocking(False)
+
+    def exec_prepared(self, statement, parameters):
+        """ queue prepared statement, returns future of its Result """
+        # libpq copies parameters into its output buffer, so they may be
+        # refilled for the next batch while this one executes
+        future = self.loop.create_future()
+        if not (self.connection.send_prepared(statement, parameters)
+                and self.connection.send_flush_request()):
+            future.set_exception(
+                RuntimeError(self.connection.error_message()))
+            return future
+        self.waiters.append(future)
+        self.flush()
+        return future
+
+    def sync(self):
+        """ queue pipeline synchronization point, returns its future """
+        future = self.loop.create_future()
+        if not self.connection.pipeline_sync():
+            future.set_exception(
+                RuntimeError(self.connection.error_message()))
+            return future
+        self.waiters.append(future)
+        self.flush()
+        return future
+
+    def flush(self):
+        """ send queued output, wait for writability if socket is full """
+        status = self.connection.flush()
+        if status == 1 and not self.writing:
+            self.loop.add_writer(self.socket, self.flush)
+            self.writing = True
+        elif status != 1 and self.writing:
+            self.loop.remove_writer(self.socket)
+            self.writing = False
+        if status == -1:
+            self.fail()
+
+    def fail(self):
+        """ fail all pending queries """
+        error = RuntimeError(self.connection.error_message())
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_exception(error)
+        self.result = None
+
+    def on_readable(self):
+        """ dispatch arrived results to waiting futures """
+        if not self.connection.consume_input():
+            self.fail()
+            return
+        while self.waiters and not self.connection.is_busy():
+            result = self.connection.get_result()
+            if result.has_result() and result.status() != \
+                    Result.ExecStatusType.PGRES_PIPELINE_SYNC:
+                if self.result is None:
+                    self.result = result
+                continue
+            if not result.has_result():
+                # end of results of the current query
+                result = self.result
+                self.result = None
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(result)
+
+
+class CopyIn:
+    """ Binary COPY FROM STDIN stream """
+
+    # signature, flags field, header extension area length
+    HEADER = b'PGCOPY\n\xff\r\n\x00' + bytes(4) + bytes(4)
+    TRAILER = b'\xff\xff'
+    NULL = b'\xff\xff\xff\xff'
+    FLUSH_SIZE = 1 << 20
+
+    def __init__(self, connection, result, columns):
+        self.connection = connection
+        self.result = result
+        self.columns = columns
+        self.chunks = [CopyIn.HEADER]
+        self.size = len(CopyIn.HEADER)
+
+    def is_ready(self):
+        """ whether server waits for COPY data """
+        return (self.result.has_result() and self.result.status() ==
+                Result.ExecStatusType.PGRES_COPY_IN)
+
+    def put_data(self, data):
+        """ send raw COPY data, returns whether it was queued """
+        started = time.perf_counter()
+        queued = Result.libpq.PQputCopyData(self.connection.pg_conn, data,
+                                            len(data)) == 1
+        self.connection.observe('put_copy_data', started,
+                                bytes_sent=len(data))
+        return queued
+
+    def put_parameters(self, parameters):
+        """ add rows encoded by parameters, `columns` values per row """
+        contents = parameters.parameters.contents
+        count = contents.current
+        assert count % self.columns == 0
+        if count == 0:
+            return True
+        pointers = ctypes.cast(contents.pointers,
+                               ctypes.POINTER(ctypes.c_void_p))
+        lengths = contents.lengths
+        base = ctypes.c_void_p.from_address(
+            ctypes.addressof(contents) + Parameters.Wrapper.values.offset
+            ).value
+        arena = ctypes.string_at(base, contents.length) if base else b''
+        field_count = self.columns.to_bytes(2, 'big')
+        chunks = self.chunks
+        if parameters.columns is not None:
+            # add_columns packs values of the same length one after another
+            chunks.append(self.pack_tuples(arena, count // self.columns))
+            self.size += len(chunks[-1])
+            if self.size >= CopyIn.FLUSH_SIZE:
+                return self.flush()
+            return True
+        for k in range(count):
+            if k % self.columns == 0:
+                chunks.append(field_count)
+            pointer = pointers[k]
+            if pointer is None:
+                chunks.append(CopyIn.NULL)
+                continue
+            length = lengths[k]
+            offset = pointer - base if base else -1
+            chunks.append(length.to_bytes(4, 'big'))
+            if 0 <= offset <= len(arena) - length:
+                chunks.append(arena[offset:offset + length])
+            else:
+                chunks.append(ctypes.string_at(pointer, length))
+            self.size += length
+        self.size += 2*(count // self.columns) + 4*count
+        if self.size >= CopyIn.FLUSH_SIZE:
+            return self.flush()
+        return True
+
+    def pack_tuples(self, arena, rows):
+        """ COPY tuples of packed values, built by strided byte copies """
+        size = Parameters.COLUMN_VALUE_LENGTH
+        field = size.to_bytes(4, 'big') + bytes(size)
+        row = self.columns.to_bytes(2, 'big') + field*self.columns
+        data = bytearray(row*rows)
+        width = size*self.columns
+        for byte in range(width):
+            column, offset = divmod(byte, size)
+            data[2 + column*len(field) + 4 + offset::len(row)] = \
+                arena[byte::width]
+        return bytes(data)
+
+    def flush(self):
+        """ send buffered rows to server """
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return self.put_data(data) if data else True
+
+    def end(self, error=None):
+        """ finish COPY, get its result """
+        started = time.perf_counter()
+        if error is None:
+            self.chunks.append(CopyIn.TRAILER)
+            if not self.flush():
+                error = self.connection.error_message()
+        Result.libpq.PQputCopyEnd(
+            self.connection.pg_conn,
+            None if error is None else error.encode('utf-8'))
+        result = self.connection.get_result()
+        while self.connection.get_result().has_result():
+            pass
+        self.connection.observe('copy_end', started, result)
+        return result
+
+
+class ConnectionPool:
+    """ Thread-safe pool of connections """
+
+    def __init__(self, conn_params, min_size=1, max_size=10,
+                 reset_sql=None, instrumentation=None):
+        assert 0 <= min_size <= max_size
+        self.conn_params = conn_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.reset_sql = reset_sql
+        self.instrumentation = instrumentation
+        self.pid = None
+        self.condition = None
+        self.idle = []
+        self.size = 0
+        self.check_process()
+        for _ in range(min_size):
+            self.release(self.connect())
+
+    def check_process(self):
+        """ forget connections inherited from the parent process """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+        self.idle = []
+        self.size = 0
+
+    def connect(self):
+        """ open new pooled connection """
+        with self.condition:
+            self.size += 1
+        try:
+            connection = Connection(self.conn_params,
+                                    instrumentation=self.instrumentation)
+        except BaseException:
+            self.discard(None)
+            raise
+        if not connection.is_connected() or not connection.status():
+            message = connection.error_message() \
+                if connection.is_connected() else "can't connect"
+            self.discard(connection)
+            raise RuntimeError(message)
+        return connection
+
+    def discard(self, connection):
+        """ close connection and free its slot """
+        if connection is not None:
+            connection.close()
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def acquire(self, timeout=None):
+        """ get healthy connection, wait if all max_size ones are in use """
+        self.check_process()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = None if deadline is None else \
+                        deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("no free connection in the pool")
+                    self.condition.wait(remaining)
+                connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                return self.connect()
+            if connection.status():
+                return connection
+            self.discard(connection)
+
+    def release(self, connection):
+        """ return connection to the pool, roll back what is left open """
+        self.check_process()
+        if connection.pid != self.pid:
+            connection.close()
+            return
+        if not connection.status():
+            self.discard(connection)
+            return
+        if connection.transaction_status() != \
+                Connection.TransactionStatusType.PQTRANS_IDLE:
+            connection.execute("ROLLBACK")
+        if self.reset_sql is not None:
+            connection.execute(self.reset_sql)
+            # DISCARD ALL or DEALLOCATE ALL drop prepared statements
+            connection.forget_deallocated()
+        if connection.transaction_status() != \
+                Connection.TransactionStatusType.PQTRANS_IDLE:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """ borrow connection for the with block """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """ close idle connections """
+        self.check_process()
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for connection in idle:
+            connection.close()
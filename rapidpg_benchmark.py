@@ -0,0 +1,82 @@
+""" Benchmark of rapidpg start up cost in a fresh interpreter """
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+# name: code run by a fresh interpreter
+STAGES = {
+    "interpreter": "pass",
+    "import": "import rapidpg",
+    "bind_libpq": "import rapidpg; rapidpg.Result.libpq.bind_all()",
+    "bind_all": "import rapidpg\n"
+                "rapidpg.Result.libpq.bind_all()\n"
+                "rapidpg.Parameters.librapidpg.bind_all()"
+}
+
+
+def measure(code, runs):
+    """ Wall clock times of runs of code in fresh interpreters"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(runs):
+        now = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", code], cwd=directory,
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE, check=False)
+        elapsed = time.perf_counter() - now
+        if process.returncode != 0:
+            return {"error": process.stderr.decode("utf-8").strip()
+                             .splitlines()[-1]}
+        times.append(elapsed)
+    return {"min_ms": min(times)*1000,
+            "median_ms": statistics.median(times)*1000,
+            "max_ms": max(times)*1000}
+
+
+def run(args):
+    """ Run selected stages, returns list of results"""
+    results = []
+    baseline = None
+    for name in args.stages:
+        result = {"stage": name, "runs": args.runs}
+        result.update(measure(STAGES[name], args.runs))
+        if name == "interpreter" and "error" not in result:
+            baseline = result["median_ms"]
+        elif baseline is not None and "error" not in result:
+            result["over_interpreter_ms"] = result["median_ms"] - baseline
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def main():
+    """ Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stages", nargs="+", default=list(STAGES),
+                        choices=list(STAGES))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": run(args)
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=1)
+
+
+if __name__ == "__main__":
+    main()
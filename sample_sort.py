@@ -0,0 +1,204 @@
+""" Parallel sample sort of numeric arrays in shared memory """
+
+import array
+import bisect
+import concurrent.futures
+import itertools
+import os
+import random
+from multiprocessing import shared_memory
+
+import algo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+OVERSAMPLING = 32
+BUCKETS_PER_WORKER = 4
+PARALLEL_CUTOFF = 1 << 16
+INTEGER_TYPECODES = 'bBhHiIlLqQ'
+
+
+def sort_typed(values, typecode):
+    """ Sort array.array in place by the fastest algo sort for its type"""
+    if typecode in INTEGER_TYPECODES:
+        algo.integer_sort(values)
+    else:
+        algo.intro_sort(values)
+
+
+def classify_chunk(name, typecode, start, end, splitters):
+    """ Group shared array[start:end] by bucket in place, returns sizes"""
+    memory = shared_memory.SharedMemory(name)
+    view = chunk = values = None
+    try:
+        view = memory.buf.cast(typecode)
+        chunk = view[start:end]
+        if numpy is not None:
+            values = numpy.frombuffer(chunk, numpy.dtype(typecode))
+            buckets = numpy.searchsorted(numpy.array(splitters, values.dtype),
+                                         values, side='right')
+            values[:] = values[numpy.argsort(buckets, kind='stable')]
+            return numpy.bincount(buckets,
+                                  minlength=len(splitters) + 1).tolist()
+        groups = [array.array(typecode) for _ in range(len(splitters) + 1)]
+        for value in chunk:
+            groups[bisect.bisect_right(splitters, value)].append(value)
+        position = 0
+        for group in groups:
+            chunk[position:position + len(group)] = group
+            position += len(group)
+        return [len(group) for group in groups]
+    finally:
+        del values
+        if chunk is not None:
+            chunk.release()
+        if view is not None:
+            view.release()
+        memory.close()
+
+
+def sort_bucket(name, typecode, start, end):
+    """ Sort shared array[start:end] in place"""
+    memory = shared_memory.SharedMemory(name)
+    view = bucket = values = None
+    try:
+        view = memory.buf.cast(typecode)
+        bucket = view[start:end]
+        if numpy is not None:
+            values = numpy.frombuffer(bucket, numpy.dtype(typecode))
+            values.sort()
+            return
+        values = array.array(typecode)
+        values.frombytes(bucket.tobytes())
+        sort_typed(values, typecode)
+        bucket[:] = values
+    finally:
+        del values
+        if bucket is not None:
+            bucket.release()
+        if view is not None:
+            view.release()
+        memory.close()
+
+
+def choose_splitters(values, buckets, oversampling, rnd):
+    """ Bucket bounds picked from a sorted random sample of values"""
+    sample = sorted(values[rnd.randrange(len(values))]
+                    for _ in range(buckets*oversampling))
+    return sample[oversampling::oversampling][:buckets - 1]
+
+
+def scatter(source, target, bounds, counts):
+    """ Copy grouped chunks of source into buckets of target"""
+    bucket_sizes = [sum(sizes) for sizes in zip(*counts)]
+    positions = [0] + list(itertools.accumulate(bucket_sizes))
+    buckets = list(zip(positions, positions[1:]))
+    for start, sizes in zip(bounds, counts):
+        for bucket, size in enumerate(sizes):
+            target[positions[bucket]:positions[bucket] + size] = \
+                source[start:start + size]
+            positions[bucket] += size
+            start += size
+    return buckets
+
+
+def parallel_sort(values, typecode, workers, oversampling, rnd):
+    """ Sort values by a pool of processes sharing memory with this one"""
+    size = len(values)
+    itemsize = array.array(typecode).itemsize
+    source = shared_memory.SharedMemory(create=True, size=size*itemsize)
+    target = shared_memory.SharedMemory(create=True, size=size*itemsize)
+    source_view = target_view = None
+    try:
+        source_view = source.buf.cast(typecode)
+        target_view = target.buf.cast(typecode)
+        if isinstance(values, array.array) and values.typecode == typecode:
+            source_view[:] = memoryview(values)
+        else:
+            source_view[:] = array.array(typecode, values)
+        splitters = choose_splitters(values, workers*BUCKETS_PER_WORKER,
+                                     oversampling, rnd)
+        bounds = [size*k // workers for k in range(workers + 1)]
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            counts = list(pool.map(
+                classify_chunk, itertools.repeat(source.name),
+                itertools.repeat(typecode), bounds, bounds[1:],
+                itertools.repeat(splitters)))
+            buckets = scatter(source_view, target_view, bounds, counts)
+#            largest buckets first to keep workers busy till the end
+            buckets = sorted((bucket for bucket in buckets
+                              if bucket[1] - bucket[0] > 1),
+                             key=lambda bucket: bucket[0] - bucket[1])
+            list(pool.map(sort_bucket, itertools.repeat(target.name),
+                          itertools.repeat(typecode),
+                          [start for start, _ in buckets],
+                          [end for _, end in buckets]))
+        if isinstance(values, array.array) and values.typecode == typecode:
+            with memoryview(values) as result:
+                result[:] = target_view
+        else:
+            values[:] = target_view.tolist()
+    finally:
+        for view in (source_view, target_view):
+            if view is not None:
+                view.release()
+        for memory in (source, target):
+            memory.close()
+            memory.unlink()
+
+
+def sample_sort(values, typecode=None, workers=None,
+                oversampling=OVERSAMPLING, reverse=False, seed=None):
+    """ Sort numeric list or array.array in place by worker processes"""
+#    typecode of array.array is used unless given, lists need one
+    if typecode is None:
+        if not isinstance(values, array.array):
+            raise TypeError("typecode is required to sort a list")
+        typecode = values.typecode
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1 or len(values) < PARALLEL_CUTOFF:
+        typed = values if isinstance(values, array.array) and \
+            values.typecode == typecode else array.array(typecode, values)
+        sort_typed(typed, typecode)
+        if typed is not values:
+            values[:] = typed.tolist()
+    else:
+        parallel_sort(values, typecode, workers, oversampling,
+                      random.Random(seed))
+    if reverse:
+        values.reverse()
+
+
+def test_sample_sort():
+    """Test sample sort"""
+    rnd = random.Random(22)
+    size = PARALLEL_CUTOFF*2
+    integers = array.array('q', (rnd.randrange(-10**12, 10**12)
+                                 for _ in range(size)))
+    expected = sorted(integers)
+    for workers in (0, 1, 2, 3):
+        values = array.array('q', integers)
+        sample_sort(values, workers=workers, seed=workers)
+        assert values.tolist() == expected
+    values = integers.tolist()
+    sample_sort(values, 'q', workers=2, reverse=True)
+    assert values == expected[::-1]
+    few_unique = [rnd.randrange(3) for _ in range(size)]
+    sample_sort(few_unique, 'l', workers=2)
+    assert few_unique == sorted(few_unique)
+    floats = array.array('d', (rnd.random() for _ in range(size // 2)))
+    sample_sort(floats, workers=2)
+    assert floats.tolist() == sorted(floats)
+    small = [3, 1, 2]
+    sample_sort(small, 'i')
+    assert small == [1, 2, 3]
+    print("sample sort : passed")
+
+
+if __name__ == "__main__":
+    test_sample_sort()